@@ -0,0 +1,225 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Pipeline Benchmark
+# MAGIC Times every `transform_*` function and `CohortProcess` end to end on synthetic inputs at several scales and reports the throughput in files/sec and rows/sec, and the peak memory (RSS) per workbook. Needs no lab data: the inputs come from `helper_Synthetic` and the outputs go to a scratch folder
+
+# COMMAND ----------
+
+import os
+import io
+import re
+import gc
+import time
+import shutil
+import contextlib
+import numpy as np
+import pandas as pd
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Synthetic
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Config
+
+# COMMAND ----------
+
+# scratch folder for the synthetic inputs and the outputs, emptied before every scale
+BENCHMARK_ROOT = '/tmp/pipeline_benchmark'
+# folder of the notebook exports, the benchmark loads their definitions from there
+NOTEBOOK_DIR = os.getcwd()
+
+# scales to run, each multiplies the number of files and cohorts of the 1x inputs
+BENCHMARK_SCALES = [1, 10, 100]
+BASE_FILES = 2
+BASE_COHORTS = 1
+NUM_SUBJECTS = 16
+TIMESTAMP_WIDTH = 50
+SEED = 0
+
+# keep the per file prints of the transforms out of the report
+QUIET = True
+
+# benchmark case -> notebook defining the function and the function timed. The cases of one notebook share one load
+BENCHMARK_CASES = {
+    'LGA': ('process_LGA', 'transform_lga_sha'),
+    'SHA': ('process_SHA', 'transform_lga_sha'),
+    'PR': ('process_PR', 'transform_pr'),
+    'SHOCK': ('process_SHOCK', 'transform_shock'),
+    'OLD_SA_LGA': ('process_LGA', 'transform_old_lga_sha_workbook'),
+    'OLD_SA_PR': ('process_PR', 'transform_old_pr_workbook'),
+    'OLD_SA_SHOCK': ('process_SHOCK', 'transform_old_shock_workbook'),
+    'COHORT': ('process_Cohort_Information', 'transform_cohorts'),
+}
+
+# sections never loaded from a process notebook: their config reads lab data and the run code walks DBFS.
+# The benchmark sets the config names itself
+SKIP_SECTIONS = ['config', 'configs', 'run code']
+# cells left out because they write to the real output files (the cohort csv headers) or start a run
+SKIP_CELLS = ['pd.DataFrame(columns=', 'main()']
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Notebook Loader
+
+# COMMAND ----------
+
+# run the cells of a notebook export in namespace, like %run does, leaving out the SKIP_SECTIONS (named by the
+# markdown header cell opening them) and the cells holding any of the SKIP_CELLS. The notebooks pulled in with
+# %run are loaded once per namespace
+def load_notebook(name, namespace):
+    loaded = namespace.setdefault('__notebooks__', set())
+    if name in loaded:
+        return namespace
+    loaded.add(name)
+
+    path = os.path.join(NOTEBOOK_DIR, name + '.py')
+    with open(path) as f:
+        cells = re.split(r'^# COMMAND -+$', f.read(), flags=re.M)
+    skipping = False
+    for cell in cells:
+        run = re.search(r'^# MAGIC %run \./(\S+)', cell, re.M)
+        header = re.search(r'^# MAGIC #+ (.+)$', cell, re.M)
+        if run:
+            load_notebook(run.group(1), namespace)
+        elif header:
+            skipping = header.group(1).strip().lower() in SKIP_SECTIONS
+        elif not skipping and not any(marker in cell for marker in SKIP_CELLS):
+            exec(compile(cell, path, 'exec'), namespace)
+    return namespace
+
+# the definitions of one process notebook, configured to read the synthetic rfids
+def load_process_notebook(name, rfid_table):
+    namespace = load_notebook(name, {'__name__': name})
+    namespace.update({
+        'existed': np.array([], dtype=object),
+        'TABLE_NAME': name.split('_', 1)[1].lower(),
+    })
+    if 'RFIDIndex' in namespace:
+        rfid_index = namespace['RFIDIndex'](rfid_table)
+        namespace.update({'RFID_COC': rfid_index, 'RFID_OXY': rfid_index})
+    if 'CohortProcess' in namespace:
+        namespace['transform_cohorts'] = lambda inputs: transform_cohorts(namespace, inputs)
+    return namespace
+
+# point the outputs of a loaded notebook at output_dir
+def set_output_dir(namespace, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    namespace.update({
+        'OUTPUT_PATH': output_dir + '/',
+        'SUBJECT_OUTPUT_FILEPATH': os.path.join(output_dir, 'cohort_subject.csv'),
+        'MEASUREMENT_OUTPUT_FILEPATH': os.path.join(output_dir, 'cohort_measurement.csv'),
+    })
+
+# CohortProcess end to end: every cohort workbook into one CohortTables, written once
+def transform_cohorts(namespace, inputs):
+    tables = namespace['CohortTables']()
+    for path, drug in inputs:
+        namespace['CohortProcess'](path, drug).insert_cohort(tables)
+    tables.write()
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Benchmark
+
+# COMMAND ----------
+
+# resident memory of this process in bytes: the current value and the peak since the last reset_peak_rss.
+# Read from /proc (Linux, as on the Databricks workers), None elsewhere
+def read_rss():
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None, None
+    return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+
+def reset_peak_rss():
+    gc.collect()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+# run one call and return the peak RSS during the call and how far it rose above the RSS before it, in MB
+def measure_call(func, args):
+    reset_peak_rss()
+    before, _ = read_rss()
+    func(*args)
+    _, peak = read_rss()
+    if peak is None:
+        return None, None
+    return round(peak / 1024**2, 1), round((peak - before) / 1024**2, 1)
+
+# time every case on the inputs of one scale, one row per case
+def run_scale(scale):
+    root = os.path.join(BENCHMARK_ROOT, '%dx' % scale)
+    shutil.rmtree(root, ignore_errors=True)
+    rfid_table, inputs = make_synthetic_inputs(os.path.join(root, 'input'),
+                                               num_files=BASE_FILES * scale,
+                                               num_subjects=NUM_SUBJECTS,
+                                               width=TIMESTAMP_WIDTH,
+                                               num_cohorts=BASE_COHORTS * scale,
+                                               seed=SEED)
+    namespaces = {}
+    results = []
+    for case, (notebook, function) in BENCHMARK_CASES.items():
+        if notebook not in namespaces:
+            namespaces[notebook] = load_process_notebook(notebook, rfid_table)
+        namespace = namespaces[notebook]
+        set_output_dir(namespace, os.path.join(root, 'output', case))
+
+        # the cohorts go through transform_cohorts together, every other input is one call
+        if case == 'COHORT':
+            calls = [([args for args, rows in inputs[case]],)]
+        else:
+            calls = [args for args, rows in inputs[case]]
+        num_files = len(inputs[case])
+        num_rows = sum(rows for args, rows in inputs[case])
+
+        # every call is one workbook (the cohorts are one call), the memory columns report the largest of them
+        quiet = contextlib.redirect_stdout(io.StringIO()) if QUIET else contextlib.nullcontext()
+        seconds, peaks, growths = 0, [], []
+        with quiet:
+            for args in calls:
+                start = time.perf_counter()
+                peak, growth = measure_call(namespace[function], args)
+                seconds += time.perf_counter() - start
+                peaks.append(peak)
+                growths.append(growth)
+
+        results.append({
+            'scale': '%dx' % scale,
+            'case': case,
+            'function': function,
+            'files': num_files,
+            'rows': num_rows,
+            'seconds': round(seconds, 3),
+            'files_per_sec': round(num_files / seconds, 2),
+            'rows_per_sec': round(num_rows / seconds, 1),
+            'peak_rss_mb': None if None in peaks else max(peaks),
+            'rss_growth_mb': None if None in growths else max(growths),
+        })
+    return results
+
+# run every scale and return the report
+def run_benchmark(scales=BENCHMARK_SCALES):
+    results = []
+    for scale in scales:
+        results += run_scale(scale)
+    return pd.DataFrame(results)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Run Benchmark
+
+# COMMAND ----------
+
+report = run_benchmark()
+print(report.to_string(index=False))
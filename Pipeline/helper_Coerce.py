@@ -0,0 +1,109 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Coercion Helpers
+# MAGIC Whole-column date and time conversion with known formats. Every distinct value is parsed once and the results are gathered back into the column. Included with `%run ./helper_Coerce`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+import datetime
+import pandas as pd
+import numpy as np
+
+# COMMAND ----------
+
+# time given to the session times that are not filled in
+MIDNIGHT = datetime.time(0, 0, 0)
+
+# COMMAND ----------
+
+# marks the values a convert function of convert_distinct could not parse
+UNPARSED = object()
+
+# convert a column through its distinct values: convert gets the distinct non-missing values once as a Series and
+# returns one result per value, missing cells get the missing value. The values convert marks UNPARSED (neither
+# missing nor of a type it reads) are logged and counted with the column name and get the missing value too.
+# Returns an object array in the column order
+@timed('coerce')
+def convert_distinct(values, convert, missing=None):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=True)
+    converted = np.empty(len(uniques) + 1, dtype=object)
+    if len(uniques):
+        converted[:-1] = list(convert(pd.Series(uniques, dtype=object)))
+    # code -1 (missing) picks the last slot
+    converted[-1] = missing
+    unparsed = np.array([v is UNPARSED for v in converted], dtype=bool)
+    if unparsed.any():
+        converted[unparsed] = missing
+        coerced = int(unparsed[codes].sum())
+        print(f'{coerced} {getattr(values, "name", None)} values are neither strings nor dates or times and are left empty')
+        count('values_coerced', coerced)
+    return converted[codes]
+
+# mask of the values that are strings
+def string_mask(values):
+    return np.array([isinstance(v, str) for v in values], dtype=bool)
+
+# parse strings with one known format in a single vectorized call, raising on the strings that do not match
+def parse_strings(values, fmt, errors='raise'):
+    return pd.Series(pd.to_datetime(values, format=fmt, errors=errors), index=values.index)
+
+# datetime.time of whole seconds since midnight
+def time_of_seconds(s):
+    return datetime.time(s // 3600, s // 60 % 60, s % 60)
+
+# the time of a value the sheet already typed (datetime, Timestamp or time) to the whole second, UNPARSED otherwise
+def typed_time(v):
+    if isinstance(v, datetime.datetime):
+        v = v.time()
+    if not isinstance(v, datetime.time):
+        return UNPARSED
+    return time_of_seconds(round(v.hour * 3600 + v.minute * 60 + v.second + v.microsecond / 1e6) % 86400)
+
+# the date of a value the sheet already typed (datetime, Timestamp or date), UNPARSED otherwise
+def typed_date(v):
+    if isinstance(v, datetime.datetime):
+        return v.date()
+    if isinstance(v, datetime.date):
+        return v
+    return UNPARSED
+
+# datetime.time of every value: strings are parsed with fmt and built from the whole seconds since midnight, raising
+# on the strings that do not match, the dates and times typed by the sheet are converted. Missing values get default
+def parse_times(values, fmt="%H:%M:%S", default=None):
+    def convert(uniques):
+        is_str = string_mask(uniques)
+        out = pd.Series([typed_time(v) for v in uniques[~is_str]], index=uniques.index[~is_str], dtype=object)
+        out = out.reindex(uniques.index)
+        parsed = parse_strings(uniques[is_str], fmt)
+        seconds = ((parsed - parsed.dt.normalize()) // pd.Timedelta(seconds=1)).to_numpy(dtype='int64')
+        out[is_str] = [time_of_seconds(s) for s in seconds]
+        return out
+    return pd.Series(convert_distinct(values, convert, missing=default), index=getattr(values, 'index', None))
+
+# datetime.date of every value: strings are parsed with fmt, raising on the strings that do not match, the dates
+# typed by the sheet are converted. Missing values get default
+def parse_dates(values, fmt="%Y-%m-%d", default=None):
+    def convert(uniques):
+        is_str = string_mask(uniques)
+        out = pd.Series([typed_date(v) for v in uniques[~is_str]], index=uniques.index[~is_str], dtype=object)
+        out = out.reindex(uniques.index)
+        out[is_str] = list(parse_strings(uniques[is_str], fmt).dt.date)
+        return out
+    return pd.Series(convert_distinct(values, convert, missing=default), index=getattr(values, 'index', None))
+
+# Timestamp of every value, like pd.to_datetime(x, format=fmt, errors='ignore') per cell: strings that do not match
+# the format are kept as they are and missing values become NaT
+def parse_timestamps(values, fmt="%Y-%m-%d"):
+    def convert(uniques):
+        out = uniques.copy()
+        is_str = string_mask(uniques)
+        parsed = parse_strings(uniques[is_str], fmt, errors='coerce')
+        out[parsed[parsed.notna()].index] = parsed[parsed.notna()]
+        others = uniques[~is_str]
+        out[others.index] = [pd.to_datetime(v, errors='ignore') for v in others]
+        return out
+    return pd.Series(convert_distinct(values, convert, missing=pd.NaT), index=getattr(values, 'index', None)).infer_objects()
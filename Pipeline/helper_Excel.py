@@ -0,0 +1,249 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Excel Helpers
+# MAGIC Shared readers for the MED-PC workbooks. Included by the process notebooks with `%run ./helper_Excel`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Sniff
+
+# COMMAND ----------
+
+import os
+import io
+import re
+import pickle
+import hashlib
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+from collections import defaultdict
+from openpyxl import load_workbook
+
+# COMMAND ----------
+
+# parsed-sheet cache: the raw frame of every parsed sheet (before any transformation) is kept as a feather file keyed by
+# the workbook content hash, so logic-only re-runs skip the excel parsing. None disables the cache
+EXCEL_CACHE_DIR = None
+# total size kept in the cache, the least recently used sheets are evicted above it
+EXCEL_CACHE_MAX_BYTES = 20 * 1024**3
+
+# the strings read_excel reads as missing values (its default na_values)
+EXCEL_NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+                   'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null'}
+
+# COMMAND ----------
+
+# sha256 of a workbook given as a path, bytes or an in-memory or memory-mapped buffer. The inputs of the tasks carry
+# the one open_input took
+def workbook_digest(source):
+    if getattr(source, 'sha256', None) is not None:
+        return source.sha256
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    elif hasattr(source, 'getbuffer'):
+        with source.getbuffer() as buffer:
+            digest.update(buffer)
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def sheet_cache_path(digest, reader, sheet_name):
+    key = hashlib.sha256(f'{reader}:{sheet_name}'.encode()).hexdigest()[:16]
+    return os.path.join(EXCEL_CACHE_DIR, f'{digest}-{key}.feather')
+
+# store a parsed sheet as feather. Column labels and the index are restored from the schema metadata, object
+# columns arrow cannot type (numbers mixed with strings, as in the transposed MED-PC sheets) are stored as pickled cells
+def save_cached_sheet(path, df):
+    columns, pickled = {}, []
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        try:
+            columns[str(i)] = pa.array(col, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[str(i)] = pa.array([pickle.dumps(v) for v in col], type=pa.binary())
+            pickled.append(i)
+    objects = [i for i in range(df.shape[1]) if df.dtypes.iloc[i] == object]
+    table = pa.table(columns).replace_schema_metadata({
+        'columns': pickle.dumps(df.columns), 'index': pickle.dumps(df.index), 'pickled': pickle.dumps(pickled), 'objects': pickle.dumps(objects)
+    })
+    os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    feather.write_feather(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+    evict_sheet_cache()
+
+def load_cached_sheet(path):
+    table = feather.read_table(path)
+    metadata = table.schema.metadata
+    df = table.to_pandas()
+    for i in pickle.loads(metadata[b'pickled']):
+        df.iloc[:, i] = [pickle.loads(v) for v in df.iloc[:, i]]
+    for i in pickle.loads(metadata[b'objects']):
+        if df.dtypes.iloc[i] != object:
+            df.isetitem(i, df.iloc[:, i].astype(object))
+    df.columns = pickle.loads(metadata[b'columns'])
+    df.index = pickle.loads(metadata[b'index'])
+    # mark the entry as recently used for the eviction
+    os.utime(path)
+    return df
+
+# drop the least recently used sheets until the cache fits in EXCEL_CACHE_MAX_BYTES
+def evict_sheet_cache():
+    entries = []
+    for entry in os.scandir(EXCEL_CACHE_DIR):
+        if entry.name.endswith('.feather'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum([size for _, size, _ in entries])
+    for _, size, path in sorted(entries):
+        if total <= EXCEL_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+# return the cached frame of one sheet, or parse it with parse() and cache it
+def cached_sheet(digest, reader, sheet_name, parse):
+    if EXCEL_CACHE_DIR is None:
+        count('sheets_parsed')
+        return parse()
+    path = sheet_cache_path(digest, reader, sheet_name)
+    if os.path.exists(path):
+        try:
+            df = load_cached_sheet(path)
+            count('sheets_cached')
+            return df
+        except (OSError, pa.ArrowInvalid):
+            pass
+    count('sheets_parsed')
+    df = parse()
+    save_cached_sheet(path, df)
+    return df
+
+# COMMAND ----------
+
+# parse the matching sheets of one workbook one at a time from a single handle, as (sheet name, frame). The rows are
+# walked with the openpyxl read-only iterators, so only the sheet handed out is held: once the caller moves on to the
+# next sheet, the previous frame is released by this side. Sheets found in the parsed-sheet cache are not parsed again.
+# With on_error, a sheet that can not be parsed is handed to it (inside the except block) and the next one is parsed
+def iter_workbook_sheets(file_name, sheet_filter=None, on_error=None):
+    if isinstance(file_name, str):
+        count('bytes_read', os.path.getsize(file_name))
+    with pd.ExcelFile(file_name, engine='openpyxl') as xls:
+        worksheets = sorted([ws for ws in xls.sheet_names if sheet_filter is None or sheet_filter(ws)])
+        digest = workbook_digest(file_name) if EXCEL_CACHE_DIR is not None and worksheets else None
+        for ws in worksheets:
+            try:
+                with span('read'):
+                    df = cached_sheet(digest, 'read_excel', ws, lambda: pd.read_excel(xls, sheet_name=ws))
+            except Exception:
+                if on_error is None:
+                    raise
+                on_error(ws)
+                continue
+            yield ws, df
+            del df
+
+# parse a single sheet of a workbook
+def read_sheet(file_name, sheet_name):
+    return dict(iter_workbook_sheets(file_name, lambda ws: ws == sheet_name))[sheet_name]
+
+# one cell of a wide export as read_excel gives it: the empty cells and the NA strings are NaN and the whole floats ints
+def to_cell_value(v):
+    if v is None or (isinstance(v, str) and v in EXCEL_NA_VALUES):
+        return np.nan
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return v
+
+# pack one sheet row into a typed column: float64 when every cell is numeric or empty, object otherwise
+def to_column_buffer(values):
+    if all([v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values]):
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return np.array([to_cell_value(v) for v in values], dtype=object)
+
+# whether the subject cells of a row are all a plain 0: a slot MED-PC padded after the last event of an array
+def is_zero_row(values):
+    return len(values) > 0 and all([type(v) in (int, float) and v == 0 for v in values])
+
+# read a MED-PC wide export (one label per row, one subject per column) straight into one typed column per label.
+# This gives the same frame as read_excel + transpose + header promotion, without the transposed all-object copy.
+# The labels matching one of array_patterns are array slots (Active 1.., Reward 1..): the slots a block holds after
+# its last event are only zeros padding it to its fixed width, they are left out of the frame
+@timed('read')
+def read_medpc_wide(source, sheet_name=None, max_subjects=None, array_patterns=()):
+    if EXCEL_CACHE_DIR is None:
+        count('sheets_parsed')
+        return parse_medpc_wide(source, sheet_name, max_subjects, array_patterns)
+    return cached_sheet(workbook_digest(source), f'read_medpc_wide:{max_subjects}:{list(array_patterns)}', sheet_name,
+                        lambda: parse_medpc_wide(source, sheet_name, max_subjects, array_patterns))
+
+# the rows are walked with a read-only openpyxl iterator. The <dimension> tag of the sheet is not trusted, some writers
+# leave it stale (A1): the dimensions are reset as pandas does, so every row is read. Repeated labels are kept as
+# repeated columns, as the header promotion keeps them
+def parse_medpc_wide(source, sheet_name=None, max_subjects=None, array_patterns=()):
+    arrays = [re.compile(pattern) for pattern in array_patterns]
+    wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb[sheet_name] if sheet_name is not None else wb.worksheets[0]
+        ws.reset_dimensions()
+
+        labels, buffers = [], []
+        # zero slots of every array block not yet followed by a filled one, they are padding if none comes
+        padding = defaultdict(list)
+        num_subjects = None
+        max_col = max_subjects + 1 if max_subjects is not None else None
+        for row in ws.iter_rows(max_col=max_col, values_only=True):
+            if len(row) == 0 or row[0] is None:
+                continue
+            label = row[0]
+            # the first row (Filename) decides how many subject columns the sheet holds
+            if num_subjects is None:
+                filled = [i for i, v in enumerate(row[1:]) if v is not None]
+                num_subjects = filled[-1] + 1 if filled else 0
+            values = row[1:num_subjects+1]
+            values = values + (None,) * (num_subjects - len(values))
+
+            labels.append(label)
+            block = next((p for p in arrays if isinstance(label, str) and p.fullmatch(label)), None)
+            if block is not None:
+                if is_zero_row(values):
+                    # keep the place of the slot in the column order until the block shows it is not padding
+                    buffers.append(None)
+                    padding[block].append(len(buffers) - 1)
+                    continue
+                for held in padding.pop(block, []):
+                    buffers[held] = np.zeros(num_subjects, dtype=np.float64)
+            buffers.append(to_column_buffer(values))
+    finally:
+        wb.close()
+
+    kept = [i for i, buffer in enumerate(buffers) if buffer is not None]
+    count('array_slots_skipped', len(buffers) - len(kept))
+    df = pd.DataFrame({i: buffers[i] for i in kept}, index=pd.RangeIndex(num_subjects or 0))
+    df.columns = pd.Index([labels[i] for i in kept], dtype=object)
+    return df
+
+# count the distinct integer values in one parsed row, e.g. the box numbers that tell how many subjects a sheet holds
+def count_integer_values(values):
+    ints = set()
+    for v in values:
+        if isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+            ints.add(int(v))
+        elif isinstance(v, (float, np.floating)) and not np.isnan(v) and float(v).is_integer():
+            ints.add(int(v))
+    return len(ints)
@@ -0,0 +1,697 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## MED-PC Session Engine
+# MAGIC One transform for the wide MED-PC session exports of LGA, SHA, PR and SHOCK, driven by a spec per experiment type. Included by the process notebooks with `%run ./helper_MedPC`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Excel
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_RFID
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Coerce
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Runner
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Sniff
+
+# COMMAND ----------
+
+import os
+import io
+import re
+import datetime
+import traceback
+import pandas as pd
+import numpy as np
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Shared Steps
+
+# COMMAND ----------
+
+# metadata labels of every MED-PC export, not kept in the output
+MEDPC_METADATA_COLUMNS = ['Filename', 'Experiment', 'Group', 'MSN', 'FR']
+# session labels every MED-PC export needs to be transformed
+MEDPC_SESSION_LABELS = ['Subject', 'Box', 'Start Date', 'End Date', 'Start Time', 'End Time']
+
+# clean subject id
+def clean_subject_id(sid):
+    sid = sid.upper()
+    if 'F' in sid:
+        char = 'F'
+    if 'M' in sid:
+        char = 'M'
+
+    idx = sid.index(char)
+    return sid[idx:].split('.')[0]
+
+# convert column names into correct format
+def clean_cols(s):
+    if 'Y' in s:
+        return s.replace('Y','Active ')
+    elif 'U' in s:
+        return s.replace('U','Inactive ')
+    elif 'V' in s:
+        return s.replace('V','Reward ')
+    else:
+        return s
+
+# transpose an old format sheet (one label per row) and promote its first row to the header.
+# The subjects found there are the rows the old transforms read in
+@timed('transpose')
+def promote_header(df_sheet):
+    # the sheet column labels become the first column, the first sheet column (the labels) the header
+    values = df_sheet.to_numpy()
+    labels = df_sheet.columns.to_numpy(dtype=object)
+    df = pd.DataFrame(values[:, 1:].T, index=pd.RangeIndex(1, len(labels)))
+    df.insert(0, 'index', labels[1:])
+    df.columns = pd.Index(np.concatenate([labels[:1], values[:, 0]]), name=0)
+    count('rows_in', len(df))
+    return df
+
+# get rid of 0s: drop the columns holding only zeros or empty cells, the remaining empty cells become 0. With select,
+# only the columns it accepts are kept too: the column selection of the transform and the zero columns are filtered
+# out of the values in one pass
+@timed('clear_zeros')
+def clear_zero_columns(df, select=None):
+    # one mask finds the columns to drop, only the kept columns are copied
+    values = df.to_numpy()
+    zeros = values == 0
+    keep = ~(zeros | pd.isna(values)).all(axis=0)
+    if select is not None:
+        keep = np.array([k and bool(select(col)) for col, k in zip(df.columns, keep)], dtype=bool)
+    any_zeros = zeros.any()
+    values = values[:, keep]
+    # the zeros go through NaN, so the columns get the same types as with replace(0, NaN) and fillna(0)
+    if any_zeros:
+        values[zeros[:, keep]] = np.nan
+    df = pd.DataFrame(values, index=df.index, columns=df.columns[keep])
+    if any_zeros:
+        df = df.infer_objects()
+    df.fillna(0, inplace=True)
+    return df
+
+# collapse every group of numbered array columns (Active 1..N, Reward 1..N, ...) into one column of per-row arrays
+# and drop the numbered columns. groups maps the output column to the regex its numbered labels match
+@timed('group_timestamps')
+def group_arrays(df, groups, integer=False):
+    grouped = []
+    for name, pattern in groups.items():
+        cols = [col for col in df.columns if isinstance(col, str) and re.fullmatch(pattern, col)]
+        offsets, values = trim_timestamp_block(df[cols], integer=integer)
+        df[name] = split_ragged(offsets, values)
+        grouped += cols
+    return df.drop(columns=grouped)
+
+# event arrays the session metrics are computed for (in the normalized column names), and the prefix of their
+# metric columns, e.g. reward_latency, active_iri_mean, active_rate_curve
+EVENT_METRIC_ARRAYS = {'active_timestamps': 'active', 'reward_timestamps': 'reward'}
+
+# add the session metrics of every event array of the table (normalized column names) as extra columns after the
+# others, computed from the in-memory arrays before they are serialized, so the analyses read them instead of parsing
+# the event strings. Called once the rfid merge dropped the rows that are not written
+def add_event_metrics(df):
+    for col, prefix in EVENT_METRIC_ARRAYS.items():
+        if col not in df.columns:
+            continue
+        for metric, values in event_metrics(*pack_ragged(df[col])).items():
+            df[f'{prefix}_{metric}'] = values
+    return df
+
+# RFID index of one drug
+def rfid_table(drug):
+    return RFID_OXY if drug == 'oxycodone' else RFID_COC
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Sniffing
+
+# COMMAND ----------
+
+# file names the drivers leave out for the experiment type (dissections, tests, backups, ...)
+def medpc_skips_name(filepath, spec):
+    return any([name in filepath for name in spec['skip_names']])
+
+# labels a MED-PC export needs to go through the transform of spec, the sniffing pass reads the sheet up to them
+def medpc_labels(spec):
+    return MEDPC_METADATA_COLUMNS + MEDPC_SESSION_LABELS + spec['required_labels']
+
+# subject columns to read from a sniffed export: the filled columns of its first row, and for the specs counting
+# subjects only as many as the 7th label row holds distinct box numbers. None when that row was not sniffed
+def medpc_subject_count(header, spec):
+    num_subjects = header.subject_columns
+    if spec['count_subjects']:
+        labels = list(header.labels)
+        boxes = header.row(labels[6]) if len(labels) > 6 else None
+        if boxes is None:
+            return None
+        num_subjects = min(num_subjects, count_integer_values(boxes[:num_subjects]))
+    return num_subjects
+
+# why a sniffed MED-PC export can not go through the transform of spec, None when it can. Only the header is read:
+# the export format, the labels the transform needs and the subjects it holds
+def medpc_rejection(header, spec):
+    if header.format != 'general':
+        return 'not a MED-PC wide export'
+    missing = [label for label in medpc_labels(spec) if label not in header.labels]
+    if missing:
+        return 'missing the labels ' + ', '.join(missing)
+    num_subjects = medpc_subject_count(header, spec)
+    if num_subjects is None:
+        return f'box numbers not in the first {SNIFF_ROWS} rows'
+    if num_subjects == 0:
+        return 'no subjects'
+    return None
+
+# the sheets of one OLD_SA workbook passing sheet_filter, none when the file is not a readable workbook
+def old_sa_worksheets(filepath, sheet_filter=None):
+    try:
+        worksheets = sniff_sheetnames(filepath)
+    except ValueError as error:
+        print(f'{filepath} rejected: {error}')
+        return []
+    return [ws for ws in worksheets if sheet_filter is None or sheet_filter(ws)]
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Engine
+
+# COMMAND ----------
+
+# transform one wide MED-PC export (General/Newer Data) following the spec of its experiment type
+def transform_medpc(filepath, spec, output_path, table_name, content=None):
+    print(filepath)
+
+    fname = filepath.split('/')[-1].split('.')[0]
+    if spec['upper_name']:
+        fname = fname.upper()
+
+    with open_input(filepath, content) as source:
+        # sniff the export first (only its first rows and the labels the transform needs), a file the transform can
+        # not handle is rejected before the full parse
+        header = sniff_workbook(source, medpc_labels(spec))
+        rejection = medpc_rejection(header, spec)
+        if rejection is not None:
+            raise ValueError(f'{filepath} rejected: {rejection}')
+
+        # Load the binary data into a pandas DataFrame, one row per subject and one typed column per label.
+        # Only the subject columns are read, the extra ones and the zero padding of the array blocks are left out of the parse
+        source.seek(0)
+        df = read_medpc_wide(source, max_subjects=medpc_subject_count(header, spec),
+                             array_patterns=list(spec['groups'].values()))
+    count('rows_in', len(df))
+
+    df.drop(MEDPC_METADATA_COLUMNS, axis=1, inplace=True)
+    if spec['dedupe_subjects']:
+        df.drop_duplicates(inplace=True)
+
+    # patch the labels some sessions do not export
+    for col, value in spec['defaults'].items():
+        if col not in df.columns:
+            df[col] = [value] * len(df)
+
+    # change data types, then group the timestamps
+    with span('coerce'):
+        df = spec['coerce'](df)
+    df = group_arrays(df, spec['groups'], integer=True)
+    df.rename(columns=spec['rename'], inplace=True)
+
+    # parse the filename
+    room, cohort, trial_id, drug = spec['parse_filename'](filepath, fname)
+    df['room'] = [room] * len(df)
+    df['cohort'] = [cohort] * len(df)
+    df['trial_id'] = [trial_id] * len(df)
+    df['drug'] = [drug] * len(df)
+
+    # calculate the derived fields, merge in the RFID and reorganize the column formats
+    df.rename(columns=str.lower,inplace=True)
+    df.columns = df.columns.str.replace(' ','_')
+    if spec['derive'] is not None:
+        df = spec['derive'](df, drug)
+    df = merge_rfid(df, rfid_table(drug), spec['columns'])
+    if spec['sort_by'] is not None:
+        df = df.sort_values(by=spec['sort_by'], ignore_index=True)
+    if spec['dedupe_rows']:
+        df = drop_duplicate_rows(df).reset_index(drop=True)
+    df = add_event_metrics(df)
+
+    # a subject in more than one row of one session file usually means two boxes were given the same subject
+    repeated = int(df['subject'].duplicated().sum())
+    if repeated:
+        print(f'{filepath}: {repeated} rows repeat a subject')
+        count('rows_repeated_subject', repeated)
+
+    write_output(df, output_path, fname, table_name)
+
+# transform one OLD_SA LGA/SHA sheet (one session, one subject per row) of workbook wb
+def transform_old_lga_sha(wb, ws, output_path, table_name, df_sheet=None):
+
+    filename = ws.split('.')[0]
+    print(wb+' : '+ws)
+
+    # Load the binary data into a pandas DataFrame, unless the driver already parsed the sheet
+    if df_sheet is None:
+        df_sheet = read_sheet(wb, ws)
+
+    # modify the header
+    df = promote_header(df_sheet)
+
+    # clean subject id
+    ID_col = df.columns.tolist()[0]
+    df[ID_col] = df[ID_col].apply(clean_subject_id)
+
+    # get rid of 0s, keep the timestamp and count columns
+    dff = clear_zero_columns(df, lambda i: i[0] in ['U','V','Y','T'] or
+                             i in [ID_col, 'Active Lever Presses', 'Inactive Lever Presses', 'Reward'])
+
+    # transform columns names
+    new_cols = [clean_cols(i) for i in dff.columns]
+    dff.columns = new_cols
+
+    # add extra info
+    if 'OXY' in ws:
+        drug = 'oxycodone'
+        parser = r'(C[0-9]{2})HSOXY((?:LGA|SHA)[0-9]{2})'
+    else:
+        drug = 'cocaine'
+        parser = r'(C[0-9]{2})HS((?:LGA|SHA)[0-9]{2})'
+
+    if '-' in ws:
+        to_split = '-'
+    if '_' in ws:
+        to_split = '_'
+
+    info, date = ws.split('.')[0].split(to_split)
+    cohort, trial_id = re.findall(parser, ws)[0]
+    dt = pd.to_datetime(date, format='%Y%m%d', errors='ignore')
+
+    dff['room'] = [None] * len(dff)
+    dff['cohort'] = [cohort[1:]] * len(dff)
+    dff['trial_id'] = [trial_id] * len(dff)
+    dff['drug'] = [drug] * len(dff)
+    dff['box'] = [None] * len(dff)
+    dff['start_time'] = [datetime.datetime.min.time()] * len(dff)
+    dff['end_time'] = [datetime.datetime.min.time()] * len(dff)
+    dff['start_date'] = [dt] * len(dff)
+    dff['end_date'] = [datetime.datetime.min.date()] * len(dff)
+
+    # group the timestamps
+    colnames = dff.columns.tolist()
+    inactive_col_begin = colnames.index('Inactive 0')
+    reward_col_begin = colnames.index('Reward 0')
+    active_col_begin = colnames.index('Active 0')
+    timeout_col_begin = colnames.index('Timeout Press 1')
+    timeout_col_end = colnames.index('room')
+
+    offsets, values = trim_timestamp_block(dff.iloc[:, inactive_col_begin:reward_col_begin])
+    dff['Inactive Timestamps'] = split_ragged(offsets, values)
+    offsets, values = trim_timestamp_block(dff.iloc[:, reward_col_begin:active_col_begin])
+    dff['Reward Timestamps'] = split_ragged(offsets, values)
+    offsets, values = trim_timestamp_block(dff.iloc[:, active_col_begin:timeout_col_begin])
+    dff['Active Timestamps'] = split_ragged(offsets, values)
+    offsets, values = trim_timestamp_block(dff.iloc[:, timeout_col_begin:timeout_col_end])
+    dff['Timeout Timestamps'] = split_ragged(offsets, values)
+    timeout_counts = count_ragged(offsets)
+    dff['Timeout Presses'] = pd.Series(timeout_counts, index=dff.index).where(timeout_counts > 0)
+
+    # reformat columns, merge rfid
+    dff.drop(dff.iloc[:, inactive_col_begin:timeout_col_end], inplace=True, axis=1)
+    dff.rename(columns={"Reward": "Reward Presses", ID_col:"subject"}, inplace=True)
+    dff.rename(columns=str.lower,inplace=True)
+    dff.columns = dff.columns.str.replace(' ','_')
+    dff['active_lever_presses'] = dff['active_lever_presses'].astype('int64')
+    dff = merge_rfid(dff, rfid_table(drug), characteristics_LGA_SHA)
+    dff = dff.sort_values(by='subject')
+    dff = add_event_metrics(dff)
+
+    write_output(dff, output_path, filename, table_name)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### OLD_SA Workbooks
+
+# COMMAND ----------
+
+# largest sheet (bytes of its uncompressed XML) an OLD_SA workbook task parses, e.g. 512 * 1024**2 on small driver
+# nodes: the memory the parse takes grows with it. A larger sheet is skipped and left out of the manifest, so it stays
+# pending and is parsed once the limit is raised. None parses every sheet
+OLD_SA_SHEET_MAX_BYTES = None
+
+# COMMAND ----------
+
+# transform the given sheets (one session each) of one OLD_SA workbook with transform(wb, ws, df_sheet), streaming:
+# the sheets are parsed one at a time from a single handle on the workbook (or its prefetched content), and every
+# session is written out by its transform before the next sheet is parsed, so only one sheet is held at a time.
+# The sheets above OLD_SA_SHEET_MAX_BYTES are left out before any parsing, their size is read from the zip directory.
+# A sheet that fails to parse or transform is reported and the next one goes on, the manifest records the others
+def transform_old_sa_workbook(wb, worksheets, transform, content=None):
+    with open_input(wb, content) as source:
+        oversized = {}
+        if OLD_SA_SHEET_MAX_BYTES is not None:
+            oversized = {ws: size for ws, size in sniff_sheet_sizes(source).items()
+                         if ws in worksheets and size > OLD_SA_SHEET_MAX_BYTES}
+            source.seek(0)
+        for ws, size in sorted(oversized.items()):
+            reason = (f'{size / 1024**2:.0f} MB of sheet XML, above the OLD_SA limit of '
+                      f'{OLD_SA_SHEET_MAX_BYTES / 1024**2:.0f} MB')
+            print(f'{wb} : {ws} skipped: {reason}')
+            skip_sheet(ws, reason)
+        for ws, df_sheet in iter_workbook_sheets(source, lambda ws: ws in worksheets and ws not in oversized,
+                                                 lambda ws: fail_old_sa_sheet(wb, ws)):
+            try:
+                transform(wb, ws, df_sheet)
+            except Exception:
+                fail_old_sa_sheet(wb, ws)
+            del df_sheet
+
+# report the sheet of an OLD_SA workbook that failed, from inside the except block
+def fail_old_sa_sheet(wb, ws):
+    print(f'{wb} : {ws} failed')
+    fail_sheet(ws, traceback.format_exc())
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Experiment Specs
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### LGA / SHA
+
+# COMMAND ----------
+
+characteristics_LGA_SHA = ['rfid','subject','room','cohort','trial_id','drug','box', 'start_time', 'end_time',
+'start_date','end_date','active_lever_presses','inactive_lever_presses','reward_presses','timeout_presses',
+'active_timestamps','inactive_timestamps','reward_timestamps','timeout_timestamps']
+
+# change data types
+def coerce_lga_sha(df):
+    cols = df.columns.tolist()
+    for col in cols:
+        name = col.lower()
+        if ('active' in name) or ('reward' in name) or ('timeout' in name) or (name == 'box'):
+            df[col] = df[col].apply(lambda x: int(x) if not pd.isnull(x) else x)
+        elif ('date' in name):
+            df[col] = parse_timestamps(df[col], '%Y-%m-%d')
+        elif ('time' in name):
+            df[col] = parse_times(df[col], "%H:%M:%S", default=MIDNIGHT)
+        else:
+            pass
+    return df
+
+# parse the filename
+def parse_lga_sha_filename(filepath, fname):
+    if fname[0] == 'C':
+        parser = r"(\AC[0-9]{2})[HS]*[OXY]*((?:LGA|SHA)[0-9]{2})"
+        cohort, trial_id = re.findall(parser, fname)[0]
+        room = None
+    else:
+        parser = r"(\A[A-Z]+[0-9]+[A-Z|0-9]{1})(C[0-9]{2})[4S|HS]*[OXY|COC|COCAINE]*((?:LGA|SHA)[0-9]{2})"
+        room, cohort, trial_id = re.findall(parser, fname)[0]
+    drug = 'oxycodone' if 'oxy' in fname.lower() else 'cocaine'
+    return room, int(cohort[1:]), trial_id, drug
+
+def derive_lga_sha(df, drug):
+    df['timeout_presses'] = df['active_lever_presses'] - df['reward_presses']
+    return df
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### PR
+
+# COMMAND ----------
+
+characteristics_PR = ['rfid', 'subject', 'room', 'cohort', 'trial_id', 'drug', 'box','start_time', 'end_time',
+ 'start_date', 'end_date', 'breakpoint', 'last_ratio', 'ratios', 'active_lever_presses', 'inactive_lever_presses',
+ 'reward_presses']
+
+class RatioSchedule:
+
+    def __init__(self, ratios):
+        '''
+            Progressive ratio schedule: ratios[r] is the ratio reached after r rewards (the breakpoint) and
+            next_ratios[r] the ratio the subject was working on when the session ended (the last ratio).
+            Both are position based, so repeated ratios (1,1,2,2,...) are not ambiguous
+        '''
+        self.ratios = np.asarray(ratios, dtype='float64')
+        self.next_ratios = np.append(self.ratios[1:], np.nan)
+
+    def lookup(self, reward_presses):
+        '''
+            breakpoint and last ratio of every session in one gather, NaN when the reward count is missing,
+            not a whole number or past the end of the schedule
+        '''
+        rewards = pd.to_numeric(pd.Series(reward_presses), errors='coerce').to_numpy(dtype='float64')
+        valid = (rewards >= 0) & (rewards < len(self.ratios)) & (rewards % 1 == 0)
+        positions = np.where(valid, rewards, 0).astype('int64')
+        breakpoints = np.where(valid, self.ratios[positions], np.nan)
+        last_ratios = np.where(valid, self.next_ratios[positions], np.nan)
+        return breakpoints, last_ratios
+
+# ratio schedules by drug
+PR_SCHEDULES = {}
+
+def register_schedule(drug, ratios):
+    PR_SCHEDULES[drug] = RatioSchedule(ratios)
+    return PR_SCHEDULES[drug]
+
+def get_schedule(drug):
+    return PR_SCHEDULES[drug]
+
+# whole number columns stay integers unless a value is missing, like the per-row lookups produced
+def ratio_column(values):
+    if np.isnan(values).any():
+        return values
+    return values.astype('int64')
+
+# set the breakpoint and last_ratio columns from the reward presses column
+def add_ratio_columns(df, drug, reward_column='reward_presses'):
+    breakpoints, last_ratios = get_schedule(drug).lookup(df[reward_column])
+    df['breakpoint'] = ratio_column(breakpoints)
+    df['last_ratio'] = ratio_column(last_ratios)
+    return df
+
+register_schedule('cocaine', [0,1,2,4,6,9,12,15,20,25,32,40,50,62,77,95,118,145,178])
+register_schedule('oxycodone', [0,1,1,2,2,3,3,4,4,5,5,6,6,7,7,8,8,9,9,10] + np.arange(10,49).tolist() + [50,60,70,80,90,100,100,100,100,100])
+
+# standardize trial id
+def process_trial_id(tid):
+    i = 0
+    while not (tid[i].isdigit()):
+        i += 1
+    name,num = tid[:i],tid[i:]
+    res = name + num.rjust(2, "0")
+    return res
+
+# serialize timestamps
+def serialize_timestamps(lst):
+    if not lst:
+        return None
+    while lst[-1] == 0:
+        lst.pop()
+    return " ".join([str(i) for i in lst])
+
+# change data types
+def coerce_pr(df):
+    cols = df.columns.tolist()
+    int_columns = ['box','last ratio']
+
+    for col in cols:
+        name = col.lower()
+        test_item = df[col][0]
+        if ('active' in name) or ('reward' in name) or (name in int_columns):
+            df[col] = df[col].apply(lambda x: int(x) if not pd.isnull(x) else None)
+        elif (("timestamps" in name) or (name in ['ratios', 'rewards_got_shock'])):
+            df[col] = df[col].apply(lambda x: serialize_timestamps(x))
+        elif ('date' in name):
+            if not isinstance(test_item, datetime.date):
+                df[col] = parse_dates(df[col], "%Y-%m-%d")
+        elif ('time' in name and 'timeout' not in name):
+            if not isinstance(test_item, datetime.time):
+                df[col] = parse_times(df[col], "%H:%M:%S")
+        else:
+            pass
+    return df
+
+# parse the file name, the drug comes from the folder
+def parse_pr_filename(filepath, fname):
+    file = filepath.split('/')[-1]
+    parsers = [r"(\A[A-Z]+[0-9]+[A-Z|0-9]{1})(C[0-9]{2})[HS]*[COCAINE|OXY]*((?:LGA|SHA|PR|TREATMENT)[0-9]+)_output",
+               r"(\AC[0-9]{2})[HS]*[OXY]*((?:LGA|SHA|PR|TREATMENT)[0-9]+)_output"]
+    if file[0] == 'C':
+        parser = parsers[1]
+        cohort, trial_id = re.findall(parser, file)[0]
+        room = None
+    else:
+        parser = parsers[0]
+        room, cohort, trial_id = re.findall(parser, file)[0]
+
+    if 'oxy' in filepath:
+        drug = 'oxycodone'
+    elif 'coc' in filepath:
+        drug = 'cocaine'
+    else:
+        raise ValueError(f'cannot tell the drug of {filepath}')
+    return room, int(cohort[1:]), process_trial_id(trial_id), drug
+
+# calculate special variables
+def derive_pr(df, drug):
+    return add_ratio_columns(df, drug)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### SHOCK
+
+# COMMAND ----------
+
+characteristics_SHOCK = ['rfid', 'subject', 'room', 'cohort', 'trial_id', 'drug', 'box',
+       'start_time', 'end_time', 'start_date', 'end_date',
+       'total_active_lever_presses', 'total_inactive_lever_presses',
+       'total_shocks', 'total_reward', 'rewards_after_first_shock',
+       'rewards_got_shock', 'reward_timestamps']
+
+# reformat shock id
+def reformat_shock_id(shock_id, cohort):
+    if 'PRESHOCK' in shock_id:
+        return 'PRESHOCK'
+    elif cohort in range(1,6):
+        return 'SHOCK' + '_V' + str(int(shock_id[5:]))
+    else:
+        return 'SHOCK_V3'
+
+# change data types
+def coerce_shock(df):
+    cols = df.columns.tolist()
+    int_columns = ['box','total shocks','total reward']
+
+    for col in cols:
+        name = col.lower()
+        if ('active' in name) or ('reward' in name) or (name in int_columns):
+            df[col] = df[col].astype('int32')
+        elif ('date' in name):
+            df[col] = parse_dates(df[col], "%Y-%m-%d")
+        elif ('time' in name):
+            df[col] = parse_times(df[col], "%H:%M:%S")
+        else:
+            pass
+    return df
+
+# parse the file name
+def parse_shock_filename(filepath, fname):
+    modified_filename = fname.replace('-','0')
+    if modified_filename[0] == 'C':
+        parser = r"(\AC[0-9]{2})HS((?:PRESHOCK[0-9]*|SHOCK[0-9]*))"
+        cohort, shock_id = re.findall(parser, modified_filename)[0]
+        room = None
+    else:
+        parser = r"(\A[A-Z]+[0-9]+[A-Z|0-9]{1})(C[0-9]{2})HS[COCAINE]*((?:PRESHOCK[0-9]*|SHOCK[0-9]*))"
+        room, cohort, shock_id = re.findall(parser, modified_filename)[0]
+
+    cohort = int(cohort[1:])
+    return room, cohort, reformat_shock_id(shock_id, cohort), 'cocaine'
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC #### Specs
+
+# COMMAND ----------
+
+# one spec per experiment type:
+#   columns          output columns, in order
+#   count_subjects   keep as many subjects as the 7th sheet row holds distinct box numbers
+#   required_labels  labels the export needs besides the metadata and session ones, checked by the sniffing pass
+#   skip_names       file name parts the drivers leave out
+#   dedupe_subjects  drop duplicated subject rows right after loading
+#   defaults         labels added with a constant value when a session does not export them
+#   coerce           dtype coercion of the raw labels
+#   groups           array column -> regex of the numbered labels collapsed into it
+#   rename           label renames applied after grouping
+#   parse_filename   (filepath, fname) -> room, cohort, trial_id, drug
+#   derive           fields computed from the normalized columns, or None
+#   sort_by          output sort column, or None
+#   dedupe_rows      drop duplicated output rows, comparing the arrays by content
+#   upper_name       upper case the output file name
+MEDPC_SPECS = {
+    'LGA': {
+        'columns': characteristics_LGA_SHA,
+        'count_subjects': False,
+        'required_labels': ['Active Lever Presses', 'Inactive Lever Presses', 'Reward'],
+        'skip_names': ['DISSECT'],
+        'dedupe_subjects': True,
+        'defaults': {'Timeout Press 1': 0},
+        'coerce': coerce_lga_sha,
+        'groups': {
+            'Active Timestamps': r'Active \d+',
+            'Inactive Timestamps': r'Inactive \d+',
+            'Reward Timestamps': r'Reward \d+',
+            'Timeout Timestamps': r'Timeout Press \d+',
+        },
+        'rename': {'Reward': 'Reward Presses'},
+        'parse_filename': parse_lga_sha_filename,
+        'derive': derive_lga_sha,
+        'sort_by': None,
+        'dedupe_rows': False,
+        'upper_name': False,
+    },
+    'PR': {
+        'columns': characteristics_PR,
+        'count_subjects': True,
+        'required_labels': ['Active Lever Presses', 'Inactive Lever Presses', 'Reward'],
+        'skip_names': ['DISSECT', 'TEST', 'PRETREAT'],
+        'dedupe_subjects': False,
+        'defaults': {},
+        'coerce': coerce_pr,
+        'groups': {'ratios': r'Reward \d+'},
+        'rename': {'Reward': 'Reward Presses'},
+        'parse_filename': parse_pr_filename,
+        'derive': derive_pr,
+        'sort_by': 'box',
+        'dedupe_rows': True,
+        'upper_name': False,
+    },
+    'SHOCK': {
+        'columns': characteristics_SHOCK,
+        'count_subjects': True,
+        'required_labels': ['Total Active Lever Presses', 'Total Inactive Lever Presses', 'Total Shocks',
+                            'Total Reward', 'Rewards After First Shock'],
+        'skip_names': ['Backup'],
+        'dedupe_subjects': False,
+        'defaults': {},
+        'coerce': coerce_shock,
+        'groups': {
+            'Rewards Got Shock': r'Reward # Got Shock \d+',
+            'Reward Timestamps': r'Reward \d+',
+        },
+        'rename': {},
+        'parse_filename': parse_shock_filename,
+        'derive': None,
+        'sort_by': 'box',
+        'dedupe_rows': False,
+        'upper_name': False,
+    },
+}
+# SHA sessions share the LGA layout
+MEDPC_SPECS['SHA'] = dict(MEDPC_SPECS['LGA'], dedupe_rows=True, upper_name=True,
+                          skip_names=['DISSECT', 'PRETREATMENT', 'Backup'])
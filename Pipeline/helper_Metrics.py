@@ -0,0 +1,147 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Metrics Helpers
+# MAGIC Per-task stage timings and counters (rows in/out, rows without an rfid, bytes read, sheets parsed, ...) written to a JSON-lines run log, and the outputs every task wrote. Included with `%run ./helper_Metrics`
+
+# COMMAND ----------
+
+import os
+import json
+import time
+import functools
+import pandas as pd
+from collections import defaultdict
+from contextlib import contextmanager
+
+# COMMAND ----------
+
+# JSON-lines run log every task appends one record to, e.g. '/dbfs/mnt/testmount/output/run_log/runs.jsonl'.
+# None keeps the records in the run_tasks results only
+RUN_LOG_PATH = None
+
+# COMMAND ----------
+
+class TaskMetrics:
+
+    def __init__(self, function, source):
+        '''
+            Seconds spent in every named stage of one task, its counters, the entries of the outputs it
+            wrote (see add_outputs), the sheets it left out with the reason (see skip_sheet), the sheets that
+            failed with the error (see fail_sheet) and the inputs it read (see add_input). A span opened inside a
+            span of the same stage is not timed twice
+        '''
+        self.function = function
+        self.source = source
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.open_stages = set()
+        self.outputs = []
+        self.skipped = {}
+        self.failed = {}
+        self.inputs = {}
+
+    def record(self, status=None, seconds=None):
+        '''
+            One run log line
+        '''
+        return {
+            'function': self.function,
+            'source': str(self.source),
+            'started': self.started,
+            'status': status,
+            'seconds': None if seconds is None else round(seconds, 4),
+            'stages': {stage: round(s, 4) for stage, s in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+# metrics of the task running in this process, None outside of a task (spans and counters are then no-ops)
+CURRENT_METRICS = None
+
+# collect the spans and counters of the enclosed task
+@contextmanager
+def task_metrics(function, source):
+    global CURRENT_METRICS
+    previous = CURRENT_METRICS
+    CURRENT_METRICS = TaskMetrics(function, source)
+    try:
+        yield CURRENT_METRICS
+    finally:
+        CURRENT_METRICS = previous
+
+# time the enclosed block as one stage of the current task
+@contextmanager
+def span(stage):
+    metrics = CURRENT_METRICS
+    if metrics is None or stage in metrics.open_stages:
+        yield
+        return
+    metrics.open_stages.add(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.stages[stage] += time.perf_counter() - start
+        metrics.open_stages.discard(stage)
+
+# decorator form of span: every call of the function is timed as stage
+def timed(stage):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# add n to a counter of the current task
+def count(name, n=1):
+    if CURRENT_METRICS is not None:
+        CURRENT_METRICS.counters[name] += int(n)
+
+# hand the entries describing an output the current task wrote back to the driver with the task outcome
+def add_outputs(entries):
+    if CURRENT_METRICS is not None:
+        CURRENT_METRICS.outputs.extend(entries)
+
+# hand the size, mtime and sha256 of an input the current task read back to the driver, the manifest records them
+def add_input(source, identity):
+    if CURRENT_METRICS is not None:
+        CURRENT_METRICS.inputs[source] = identity
+
+# hand a sheet the current task left out on purpose back to the driver with the reason, it is not recorded in the
+# manifest so the next run tries it again
+def skip_sheet(sheet, reason):
+    count('sheets_skipped')
+    if CURRENT_METRICS is not None:
+        CURRENT_METRICS.skipped[sheet] = reason
+
+# hand a sheet that failed back to the driver with the error, the task goes on with its other sheets
+def fail_sheet(sheet, error):
+    count('sheets_failed')
+    if CURRENT_METRICS is not None:
+        CURRENT_METRICS.failed[sheet] = error
+
+# COMMAND ----------
+
+# id shared by the records of one run
+def new_run_id():
+    return time.strftime('%Y%m%dT%H%M%S') + f'-{os.getpid()}'
+
+# append the task records of one run to the run log
+def write_run_log(records, run_id, path=None):
+    path = path or RUN_LOG_PATH
+    if path is None or len(records) == 0:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(dict(record, run_id=run_id), default=str) + '\n')
+
+# the run log as one row per task, with a stages.<name> and a counters.<name> column per stage and counter,
+# ready to aggregate across runs (e.g. .groupby(['run_id', 'function']).sum())
+def read_run_log(path=None):
+    path = path or RUN_LOG_PATH
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.json_normalize(records)
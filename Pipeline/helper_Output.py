@@ -0,0 +1,367 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Output Helpers
+# MAGIC Shared writers for the transformed trial tables. Included by the process notebooks with `%run ./helper_Output`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Timestamps
+
+# COMMAND ----------
+
+import os
+import io
+import re
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+
+# COMMAND ----------
+
+# event array columns and the element type they keep in the columnar outputs
+RAGGED_COLUMNS = {
+    'active_timestamps': pa.float64(),
+    'inactive_timestamps': pa.float64(),
+    'reward_timestamps': pa.float64(),
+    'timeout_timestamps': pa.float64(),
+    'rewards_got_shock': pa.float32(),
+    'ratios': pa.float32(),
+    'active_rate_curve': pa.int32(),
+    'reward_rate_curve': pa.int32(),
+}
+
+# typed list column of one event array
+def ragged_field(col):
+    return (col, pa.list_(RAGGED_COLUMNS[col]))
+
+# session metric columns of one event array (see add_event_metrics)
+def event_metric_fields(prefix):
+    return [(f'{prefix}_latency', pa.float64()), (f'{prefix}_iri_mean', pa.float64()),
+            (f'{prefix}_iri_median', pa.float64()), (f'{prefix}_bursts', pa.int64()), ragged_field(f'{prefix}_rate_curve')]
+
+# columns every MED-PC trial table opens with, the general exports and the OLD_SA sheets give them the same types
+TRIAL_SESSION_FIELDS = [('rfid', pa.int64()), ('subject', pa.string()), ('room', pa.string()), ('cohort', pa.int64()),
+                        ('trial_id', pa.string()), ('drug', pa.string()), ('box', pa.int64()),
+                        ('start_time', pa.time64('us')), ('end_time', pa.time64('us')),
+                        ('start_date', pa.date32()), ('end_date', pa.date32())]
+SA_TRIAL_SCHEMA = pa.schema(TRIAL_SESSION_FIELDS + [
+    ('active_lever_presses', pa.int64()), ('inactive_lever_presses', pa.int64()), ('reward_presses', pa.int64()),
+    ('timeout_presses', pa.int64()), ragged_field('active_timestamps'), ragged_field('inactive_timestamps'),
+    ragged_field('reward_timestamps'), ragged_field('timeout_timestamps')]
+    + event_metric_fields('active') + event_metric_fields('reward'))
+
+# arrow schema of every output table, so the part files written from different kinds of sources (general exports,
+# OLD_SA sheets) read back as one dataset. The notebooks add the tables they define (see process_IRR); the tables
+# taking their columns from the input sheets as they are (tail_immersion, von_frey, note) keep the inferred types
+OUTPUT_SCHEMAS = {
+    'trial_lga': SA_TRIAL_SCHEMA,
+    'trial_sha': SA_TRIAL_SCHEMA,
+    'trial_pr': pa.schema(TRIAL_SESSION_FIELDS + [
+        ('breakpoint', pa.int64()), ('last_ratio', pa.int64()), ragged_field('ratios'),
+        ('active_lever_presses', pa.int64()), ('inactive_lever_presses', pa.int64()), ('reward_presses', pa.int64())]),
+    'trial_shock': pa.schema(TRIAL_SESSION_FIELDS + [
+        ('total_active_lever_presses', pa.int64()), ('total_inactive_lever_presses', pa.int64()),
+        ('total_shocks', pa.int64()), ('total_reward', pa.int64()), ('rewards_after_first_shock', pa.int64()),
+        ragged_field('rewards_got_shock'), ragged_field('reward_timestamps')] + event_metric_fields('reward')),
+}
+
+# optional parquet sink. Point it at a dataset root (e.g. '/dbfs/mnt/testmount/output/parquet') to write every
+# output table there, partitioned by drug / cohort / trial_id. None writes the csv outputs only
+PARQUET_OUTPUT_ROOT = None
+PARTITION_COLUMNS = ['drug', 'cohort', 'trial_id']
+
+# secondary index of the outputs by rat: one parquet file per table under this root (e.g.
+# '/dbfs/mnt/testmount/output/session_index'), mapping every rfid and subject to the output files, row ranges and
+# csv byte ranges holding its sessions. The drivers update it after every run (see SessionIndex). None keeps no index
+SESSION_INDEX_ROOT = None
+# rows per row group of the index files, the index is sorted by rfid so a lookup reads the matching row groups only
+SESSION_INDEX_ROW_GROUP = 50000
+SESSION_INDEX_SCHEMA = pa.schema([('rfid', pa.string()), ('subject', pa.string()), ('table_name', pa.string()),
+                                  ('output', pa.string()), ('row_start', pa.int64()), ('row_stop', pa.int64()),
+                                  ('byte_start', pa.int64()), ('byte_stop', pa.int64()), ('output_bytes', pa.int64())])
+SESSION_INDEX_COLUMNS = SESSION_INDEX_SCHEMA.names
+
+# COMMAND ----------
+
+# rfid or subject of one output row as the index keeps it: a string, whole numbers without the float tail, None if missing
+def index_key(value):
+    if not isinstance(value, str) and pd.isnull(value):
+        return None
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+# index entries of one written output: the runs of consecutive rows of every (rfid, subject) as [row_start, row_stop),
+# with the bytes [byte_start, byte_stop) the run takes in the csv given the row offsets of the file (see write_csv) and
+# the size of the file. An output written with no rows gives one empty run, so the index still drops the entries it had
+def output_index_entries(df, table_name, output, offsets):
+    rfids = [index_key(v) for v in df['rfid']] if 'rfid' in df.columns else [None] * len(df)
+    subjects = [index_key(v) for v in df['subject']] if 'subject' in df.columns else [None] * len(df)
+    entries = []
+    for row, key in enumerate(zip(rfids, subjects)):
+        if entries and (entries[-1]['rfid'], entries[-1]['subject']) == key and entries[-1]['row_stop'] == row:
+            entries[-1]['row_stop'] = row + 1
+        else:
+            entries.append({'rfid': key[0], 'subject': key[1], 'table_name': table_name, 'output': output,
+                            'row_start': row, 'row_stop': row + 1})
+    if not entries:
+        entries.append({'rfid': None, 'subject': None, 'table_name': table_name, 'output': output,
+                        'row_start': 0, 'row_stop': 0})
+    for entry in entries:
+        entry['byte_start'] = int(offsets[entry['row_start']])
+        entry['byte_stop'] = int(offsets[entry['row_stop']])
+        entry['output_bytes'] = int(offsets[-1])
+    return entries
+
+# write the csv text of a table to output and return the byte offset of every row in it, followed by the size of the
+# file: row r takes the bytes [offsets[r], offsets[r+1]). A row ends at the first newline outside of quotes, as the
+# quoted fields of pandas may hold newlines (a quote inside a field is doubled, it does not change the parity)
+def write_csv(df, output):
+    data = df.to_csv(index=False).encode('utf-8')
+    with open(output, 'wb') as f:
+        f.write(data)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    quoted = np.logical_xor.accumulate(buffer == ord('"')) if len(buffer) else np.zeros(0, dtype=bool)
+    return np.flatnonzero((buffer == ord('\n')) & ~quoted) + 1
+
+# COMMAND ----------
+
+# drop duplicated rows, comparing the event array columns by content
+def drop_duplicate_rows(df):
+    keys = pd.DataFrame(index=df.index)
+    for col in df.columns:
+        if col in RAGGED_COLUMNS:
+            keys[col] = [c.tobytes() if c is not None else None for c in df[col]]
+        else:
+            keys[col] = df[col]
+    return df[~keys.duplicated()]
+
+ARROW_CAST_ERRORS = (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError)
+
+# cast one arrow array to the type of its output column, dates given as timestamps keep their day
+def cast_array(array, type):
+    if pa.types.is_date(type) and pa.types.is_timestamp(array.type):
+        return array.cast(type, safe=False)
+    return array.cast(type)
+
+# one frame column as an arrow array of the given type. With mixed python types in one column, e.g. a date that failed
+# to parse next to parsed ones, every cell is cast on its own: the ones that do not fit the type are left empty and counted
+def to_typed_array(values, type):
+    try:
+        return cast_array(pa.array(values, from_pandas=True), type)
+    except ARROW_CAST_ERRORS:
+        pass
+    if pa.types.is_string(type):
+        return pa.array([None if pd.isnull(v) else str(v) for v in values], type=type)
+    cells = []
+    for value in values:
+        try:
+            cells.append(cast_array(pa.array([value], from_pandas=True), type)[0].as_py())
+        except ARROW_CAST_ERRORS:
+            cells.append(None)
+            count('values_nulled')
+    return pa.array(cells, type=type)
+
+# convert a transformed table to arrow, the event array columns become typed list arrays. With the schema of its output
+# table every column gets the type of the schema and the columns the frame does not have are left empty
+def to_arrow_table(df, schema=None):
+    if schema is not None:
+        extra = [str(col) for col in df.columns if col not in schema.names]
+        if extra:
+            raise ValueError('columns not in the output schema: ' + ', '.join(extra))
+        arrays = []
+        for field in schema:
+            if field.name not in df.columns:
+                arrays.append(pa.nulls(len(df), field.type))
+            elif field.name in RAGGED_COLUMNS:
+                arrays.append(pa.array(list(df[field.name]), type=field.type))
+            else:
+                arrays.append(to_typed_array(df[field.name], field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+    arrays = []
+    for col in df.columns:
+        if col in RAGGED_COLUMNS:
+            arrays.append(pa.array(list(df[col]), type=pa.list_(RAGGED_COLUMNS[col])))
+            continue
+        try:
+            arrays.append(pa.array(df[col], from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # mixed python types in one column, e.g. a date that failed to parse next to parsed ones
+            arrays.append(pa.array(df[col].map(lambda x: None if pd.isnull(x) else str(x)), type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+# append one output table to the partitioned parquet dataset <root>/<table_name>, zstd compressed and dictionary
+# encoded. Each source file owns its own part files, so re-running a file replaces its rows in every partition
+def write_parquet_dataset(df, table_name, fname, partition_cols=None, root=None):
+    root = root if root is not None else PARQUET_OUTPUT_ROOT
+    df = df.copy()
+    partition_cols = [c for c in (partition_cols or PARTITION_COLUMNS) if c in df.columns]
+    # old sheets give the cohort as '01', newer files as 1: keep one partition per cohort
+    if 'cohort' in partition_cols:
+        df['cohort'] = pd.to_numeric(df['cohort'], errors='coerce').astype('Int64')
+    schema = OUTPUT_SCHEMAS.get(table_name)
+    pq.write_to_dataset(to_arrow_table(df, schema), os.path.join(root, table_name), partition_cols=partition_cols,
+                        schema=schema, basename_template=fname + '-{i}.parquet', existing_data_behavior='overwrite_or_ignore',
+                        compression='zstd', use_dictionary=True)
+
+# write one transformed table: the csv keeps the space separated strings, the parquet dataset (when PARQUET_OUTPUT_ROOT
+# is set) the typed event arrays. The rows of every rat in the csv go back to the driver for the session index
+@timed('write')
+def write_output(df, output_path, fname, table_name):
+    count('rows_out', len(df))
+    count('files_written')
+    df_csv = df.copy()
+    for col in df.columns:
+        if col in RAGGED_COLUMNS:
+            df_csv[col] = serialize_arrays(df[col])
+    output = os.path.join(output_path, fname + '.csv')
+    offsets = write_csv(df_csv, output)
+    if PARQUET_OUTPUT_ROOT is not None:
+        write_parquet_dataset(df, table_name, fname)
+    if SESSION_INDEX_ROOT is not None:
+        add_outputs(output_index_entries(df, table_name, output, offsets))
+
+# COMMAND ----------
+
+class SessionIndex:
+
+    def __init__(self, root=None, parquet_root=None):
+        '''
+            Per-rfid index of the trial outputs, one parquet file per table under root (SESSION_INDEX_ROOT by
+            default). Every entry is a run of rows of one rat in one output file, with the bytes it takes in the
+            csv, so a rat's history across all tables is read back with one filtered read per index file and one
+            targeted read per output file holding it: the csv bytes of its rows, or the part files the output
+            wrote in the parquet dataset under parquet_root (PARQUET_OUTPUT_ROOT by default) filtered on the rat
+        '''
+        self.root = root if root is not None else SESSION_INDEX_ROOT
+        self.parquet_root = parquet_root if parquet_root is not None else PARQUET_OUTPUT_ROOT
+
+    def path(self, table_name):
+        return os.path.join(self.root, table_name + '.parquet')
+
+    def tables(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted([f[:-len('.parquet')] for f in os.listdir(self.root) if f.endswith('.parquet')])
+
+    def record_results(self, results):
+        '''
+            Merge the outputs written by the tasks of a run_tasks result into the index. Every output written
+            again loses the entries it had, also when it was written with no rows. Only the tasks that succeeded
+            (in full or for some of their sheets) add entries: the outputs of a failed task stay out of the index
+            until it runs again
+        '''
+        if self.root is None:
+            return
+        # an output written twice in the run keeps the entries of its last write, every write starts at row 0
+        written, latest = {}, {}
+        for status, outputs in zip(results['status'], results['outputs']):
+            for entry in outputs:
+                written[entry['output']] = entry['table_name']
+                if entry['row_start'] == 0:
+                    latest[entry['output']] = []
+                if status in ('ok', 'partial') and entry['row_stop'] > entry['row_start']:
+                    latest[entry['output']].append(entry)
+        if not written:
+            return
+        new = pd.DataFrame([entry for writes in latest.values() for entry in writes], columns=SESSION_INDEX_COLUMNS)
+        os.makedirs(self.root, exist_ok=True)
+        for table_name in sorted(set(written.values())):
+            outputs = set([output for output, table in written.items() if table == table_name])
+            self.save(table_name, new[new['output'].isin(outputs)], outputs)
+
+    def save(self, table_name, entries, outputs):
+        '''
+            Replace the entries of the given outputs in the index file of one table, kept sorted by rfid
+        '''
+        path = self.path(table_name)
+        if os.path.exists(path):
+            old = pd.read_parquet(path)
+            entries = pd.concat([old[~old['output'].isin(outputs)], entries], ignore_index=True)
+        entries = entries.sort_values(['rfid', 'subject', 'output', 'row_start'], na_position='last', ignore_index=True)
+        table = pa.Table.from_pandas(entries[SESSION_INDEX_COLUMNS], schema=SESSION_INDEX_SCHEMA, preserve_index=False)
+        pq.write_table(table, path + '.tmp', row_group_size=SESSION_INDEX_ROW_GROUP)
+        os.replace(path + '.tmp', path)
+
+    def sessions(self, rfid=None, subject=None, tables=None):
+        '''
+            Index entries of one rat, by rfid or by subject, over the given tables (all of them by default)
+        '''
+        if (rfid is None) == (subject is None):
+            raise ValueError('give either an rfid or a subject')
+        column, key = ('rfid', rfid) if rfid is not None else ('subject', subject)
+        found = [pd.read_parquet(self.path(table_name), filters=[(column, '=', index_key(key))])
+                 for table_name in (tables or self.tables())]
+        found = [df for df in found if len(df)]
+        if not found:
+            return pd.DataFrame(columns=SESSION_INDEX_COLUMNS)
+        return pd.concat(found, ignore_index=True)
+
+    def lookup(self, rfid=None, subject=None, tables=None, sink='csv'):
+        '''
+            Output rows of one rat as table name -> frame, from the csv outputs or from the parquet dataset
+            (sink='parquet'). Only the indexed bytes of every csv are read; an output that changed since the index
+            was written (another size) is read whole and filtered on the rat, with a warning. Rows of another rat
+            are left out with a warning
+        '''
+        if sink not in ('csv', 'parquet'):
+            raise ValueError(f'unknown sink {sink}, give csv or parquet')
+        sessions = self.sessions(rfid, subject, tables)
+        column, key = ('rfid', rfid) if rfid is not None else ('subject', subject)
+        found = {}
+        for (table_name, output), entries in sessions.groupby(['table_name', 'output'], sort=True):
+            if sink == 'parquet':
+                df = self.read_parquet_rows(table_name, output, column, index_key(key))
+            elif not os.path.exists(output):
+                print(f'{output} is in the session index but no longer on disk')
+                continue
+            else:
+                df = self.read_csv_rows(output, entries)
+            matching = [index_key(v) == index_key(key) for v in df[column]] if column in df.columns else [False] * len(df)
+            if not all(matching):
+                print(f'{output}: {len(df) - sum(matching)} indexed rows are of another rat, the session index is '
+                      f'stale for it')
+                df = df[np.array(matching, dtype=bool)]
+            df.insert(0, 'output', output)
+            found.setdefault(table_name, []).append(df)
+        return {table_name: pd.concat(frames, ignore_index=True) for table_name, frames in found.items()}
+
+    @staticmethod
+    def read_csv_rows(output, entries):
+        '''
+            The rows of the given index entries of one csv output: the header line, then a seek and a read of the
+            bytes of every run. The whole file when it is not the size the index knows
+        '''
+        size = os.path.getsize(output)
+        if entries['output_bytes'].isna().any() or (entries['output_bytes'] != size).any():
+            print(f'{output} changed since the session index was written, it is read whole')
+            return pd.read_csv(output)
+        with open(output, 'rb') as f:
+            chunks = [f.readline()]
+            for start, stop in zip(entries['byte_start'], entries['byte_stop']):
+                f.seek(int(start))
+                chunks.append(f.read(int(stop) - int(start)))
+        return pd.read_csv(io.BytesIO(b''.join(chunks)))
+
+    def read_parquet_rows(self, table_name, output, column, key):
+        '''
+            The rows of one rat in the part files one output wrote to the parquet dataset of table_name (named
+            after the csv, see write_parquet_dataset), with the filter on the rat pushed down to the row groups
+        '''
+        if self.parquet_root is None:
+            raise ValueError('no parquet dataset, set PARQUET_OUTPUT_ROOT or give parquet_root')
+        base_dir = os.path.join(self.parquet_root, table_name)
+        part = re.compile(re.escape(os.path.splitext(os.path.basename(output))[0]) + r'-\d+\.parquet')
+        files = [os.path.join(folder, f) for folder, _, names in os.walk(base_dir) for f in sorted(names) if part.fullmatch(f)]
+        if not files:
+            print(f'{output} has no part files in {base_dir}')
+            return pd.DataFrame(columns=[column])
+        dataset = ds.dataset(sorted(files), format='parquet', partitioning='hive', partition_base_dir=base_dir)
+        field = dataset.schema.field(column)
+        try:
+            value = pa.scalar(key).cast(field.type)
+        except ARROW_CAST_ERRORS:
+            return dataset.schema.empty_table().to_pandas()
+        return dataset.to_table(filter=ds.field(column) == value).to_pandas()
@@ -0,0 +1,76 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## RFID Helpers
+# MAGIC Subject to RFID lookup shared by the process notebooks. Included with `%run ./helper_RFID`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+import pandas as pd
+import numpy as np
+
+# COMMAND ----------
+
+# rfid given to the subjects missing from an RFID table
+MISSING_RFID = -999
+
+# loaded indexes by path, so every table is read once per run
+RFID_INDEXES = {}
+
+# COMMAND ----------
+
+class RFIDIndex:
+
+    def __init__(self, table):
+        '''
+            Hash index over one subject -> rfid table (the RFID csv with its subject and rfid columns). Subjects
+            without an rfid are left out, a subject listed twice keeps its first rfid
+        '''
+        table = table.dropna(subset=['subject', 'rfid']).drop_duplicates(subset=['subject'], keep='first')
+        self.subjects = pd.Index(table['subject'])
+        self.rfids = table['rfid'].to_numpy().astype('int64')
+
+    def lookup(self, subjects):
+        '''
+            rfid of every subject in one vectorized lookup (MISSING_RFID for the misses) and the mask of the subjects found
+        '''
+        positions = self.subjects.get_indexer(pd.Index(subjects))
+        found = positions >= 0
+        rfids = np.full(len(positions), MISSING_RFID, dtype='int64')
+        rfids[found] = self.rfids[positions[found]]
+        return rfids, found
+
+    def report_missing(self, subjects, found):
+        missing = sorted(set([str(s) for s in np.asarray(subjects)[~found]]))
+        if missing:
+            print(f'{len(missing)} subjects without an rfid: {missing}')
+
+# load the RFID csv at path into an RFIDIndex, once per run
+def load_rfid_index(path):
+    if path not in RFID_INDEXES:
+        RFID_INDEXES[path] = RFIDIndex(pd.read_csv(path, index_col=0))
+    return RFID_INDEXES[path]
+
+# keep the subjects found in the index and set their rfid (inner join)
+@timed('rfid_merge')
+def merge_rfid(df, rfid_index, columns):
+    rfids, found = rfid_index.lookup(df['subject'])
+    rfid_index.report_missing(df['subject'], found)
+    count('rows_dropped_rfid', (~found).sum())
+    df = df[found].assign(rfid=rfids[found]).reset_index(drop=True)
+    return df[columns]
+
+# put the rfid of every subject in the first column, empty for the subjects not found (left join)
+@timed('rfid_merge')
+def insert_rfid(df, rfid_index):
+    rfids, found = rfid_index.lookup(df['subject'])
+    rfid_index.report_missing(df['subject'], found)
+    count('rows_missing_rfid', (~found).sum())
+    rfids = pd.array(rfids, dtype='Int64')
+    rfids[~found] = pd.NA
+    df = df.copy()
+    df.insert(0, 'rfid', rfids)
+    return df
@@ -0,0 +1,329 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Runner Helpers
+# MAGIC Parallel runner for the per-file driver loops. Included by the process notebooks with `%run ./helper_Runner`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+import os
+import io
+import mmap
+import time
+import hashlib
+import datetime
+import threading
+import traceback
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# COMMAND ----------
+
+# number of worker processes used by run_tasks, override in the notebook config if needed
+N_WORKERS = os.cpu_count()
+
+# input files run_tasks reads ahead of the running tasks into the page cache, and the most bytes read ahead. The tasks
+# map their inputs either way (see open_input), 0 files turns the prefetch off
+PREFETCH_FILES = 4
+PREFETCH_MAX_BYTES = 1024**3
+
+# COMMAND ----------
+
+class MappedInput(io.RawIOBase):
+
+    def __init__(self, filepath):
+        '''
+            Read-only file object over a memory map of filepath: zipfile and the excel readers on top of it read
+            the pages of the file in place, the file is never copied whole into memory. The stat of the file is
+            the one of the mapped content
+        '''
+        super().__init__()
+        with open(filepath, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.size = self.stat.st_size
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if self.map is None or end <= self.position:
+            return b''
+        data = self.map[self.position:end]
+        self.position = end
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(start + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def getbuffer(self):
+        '''
+            The mapped bytes, e.g. to hash the workbook without reading it again
+        '''
+        return memoryview(self.map if self.map is not None else b'')
+
+    def close(self):
+        if self.map is not None and not self.closed:
+            self.map.close()
+        super().close()
+
+# the input of one task as a file object: the file memory-mapped, or the content when a caller hands the bytes over.
+# The size, mtime and sha256 of the content the task parses go back to the driver for the manifest (see add_input),
+# the sha256 is also kept on the file object for the parsed-sheet cache
+def open_input(filepath, content=None):
+    if content is None:
+        source = MappedInput(filepath)
+        stat, size = source.stat, source.size
+        with source.getbuffer() as buffer:
+            source.sha256 = hashlib.sha256(buffer).hexdigest()
+    else:
+        source = io.BytesIO(content)
+        stat, size = os.stat(filepath), len(content)
+        source.sha256 = hashlib.sha256(content).hexdigest()
+    count('bytes_read', size)
+    add_input(filepath, {'size': size, 'mtime': stat.st_mtime, 'sha256': source.sha256})
+    return source
+
+# worker start-up: install the read-only tables shared by every task (RFID maps, ...) as notebook globals
+def init_worker(shared):
+    globals().update(shared)
+
+# run one (function, args) task and record its outcome instead of raising, so one bad file never stops the run.
+# content is the error the prefetch got reading the input of the task, None lets the task read its input.
+# A task some sheets of which failed is 'partial'. The stage timings and counters of the task, the entries of
+# the outputs it wrote and the sheets it skipped or that failed come back with the outcome
+def run_task(task, content=None):
+    func, args = task
+    start = time.time()
+    with task_metrics(func.__name__, args[0]) as metrics:
+        try:
+            if isinstance(content, Exception):
+                raise content
+            if content is None:
+                func(*args)
+            else:
+                func(*args, content=content)
+            status, error = 'ok', None
+            if metrics.failed:
+                status = 'partial'
+                error = '\n'.join([f'{sheet}:\n{message}' for sheet, message in metrics.failed.items()])
+        except Exception:
+            status, error = 'error', traceback.format_exc()
+    seconds = time.time() - start
+    return {'function': func.__name__, 'source': args[0], 'sheets': args[1] if len(args) > 1 else None,
+            'status': status, 'error': error, 'seconds': seconds, 'metrics': metrics.record(status, seconds),
+            'outputs': metrics.outputs, 'skipped': metrics.skipped, 'failed': metrics.failed,
+            'input': metrics.inputs.get(args[0])}
+
+# the inputs of the tasks as run_task takes them: None, every task maps its own input, once read ahead into the page
+# cache with prefetch (or the error reading it)
+def task_inputs(tasks, prefetch):
+    if not prefetch:
+        return [None] * len(tasks)
+    return Prefetcher([args[0] for func, args in tasks]).start()
+
+# fan the discovered (function, (source, ...)) tasks out to a process pool. The shared tables are handed to every
+# worker once at start-up, the notebook functions are resolved in the workers through fork, so the pool uses fork.
+# With prefetch the source files are read into the page cache on a background thread while the tasks before them
+# parse, the tasks then map them (no bytes go through the pool queue)
+def run_tasks(tasks, max_workers=None, shared=None, prefetch=None):
+    max_workers = max_workers or N_WORKERS
+    shared = shared or {}
+    if prefetch is None:
+        prefetch = PREFETCH_FILES > 0
+
+    if max_workers == 1:
+        init_worker(shared)
+        contents = task_inputs(tasks, prefetch)
+        results = [run_task(task, content) for task, content in zip(tasks, contents)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=init_worker, initargs=(shared,)) as pool:
+            # fork every worker before the prefetch thread starts, a forked worker would inherit the locks it holds
+            pool.submit(int).result()
+            contents = task_inputs(tasks, prefetch)
+            futures, pending = [], set()
+            for task, content in zip(tasks, contents):
+                # keep the queue short, so the files read ahead are mapped before the page cache drops them
+                if len(pending) >= max_workers + PREFETCH_FILES:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                future = pool.submit(run_task, task, content)
+                futures.append(future)
+                pending.add(future)
+            results = [future.result() for future in futures]
+
+    write_run_log([result['metrics'] for result in results], new_run_id())
+    results = pd.DataFrame(results, columns=['function', 'source', 'sheets', 'status', 'error', 'seconds', 'metrics', 'outputs',
+                                    'skipped', 'failed', 'input'])
+    failed = results[results['status'] != 'ok']
+    print(f'{len(results) - len(failed)} of {len(results)} tasks succeeded')
+    for _, row in failed.iterrows():
+        print(row['source'])
+        print(row['error'])
+    return results
+
+# COMMAND ----------
+
+class Prefetcher:
+
+    def __init__(self, paths, max_files=PREFETCH_FILES, max_bytes=PREFETCH_MAX_BYTES):
+        '''
+            Read the given files into the page cache on a background thread (see start), in order, while the
+            caller works on the ones before. At most max_files are read ahead and together they are at most
+            max_bytes (a larger file is read once nothing else is ahead). Iterating gives None for every file in
+            order once it was read, or the error reading it
+        '''
+        self.paths = list(paths)
+        self.max_files = max(max_files, 1)
+        self.max_bytes = max_bytes
+        self.outcomes = {}
+        self.sizes = {}
+        self.ahead_bytes = 0
+        self.consumed = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.read_ahead, name='prefetch', daemon=True)
+
+    def start(self):
+        '''
+            Start the background thread, once no process is forked from this one anymore
+        '''
+        self.thread.start()
+        return self
+
+    def read_ahead(self):
+        '''
+            Background thread: wait for room in the budget, then read the next file
+        '''
+        for i, path in enumerate(self.paths):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            with self.condition:
+                self.condition.wait_for(lambda: i - self.consumed < self.max_files and
+                                        (self.ahead_bytes == 0 or self.ahead_bytes + size <= self.max_bytes))
+                self.ahead_bytes += size
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        pass
+                content = None
+            except Exception as error:
+                content = error
+            with self.condition:
+                self.sizes[i] = size
+                self.outcomes[i] = content
+                self.condition.notify_all()
+
+    def __iter__(self):
+        for i in range(len(self.paths)):
+            with self.condition:
+                self.condition.wait_for(lambda: i in self.outcomes)
+                content = self.outcomes.pop(i)
+                self.ahead_bytes -= self.sizes.pop(i)
+                self.consumed = i + 1
+                self.condition.notify_all()
+            yield content
+
+    def __len__(self):
+        return len(self.paths)
+
+# COMMAND ----------
+
+class Manifest:
+
+    def __init__(self, path, pipeline_version):
+        '''
+            Persistent record of every parsed input, keyed by source path + sheet ('' for single sheet files) and
+            stored as one parquet file per pipeline. An input is re-parsed only if it is new, its content changed
+            or it was parsed by another pipeline version. Only the sheets a task transformed are recorded: the
+            sheets it skipped or that failed stay pending and are tried again on the next run. The size, mtime
+            and sha256 recorded are the ones of the content the task parsed, taken when it read its input
+        '''
+        self.path = path
+        self.pipeline_version = pipeline_version
+        self.entries = {}
+        self.hashes = {}
+        if os.path.exists(path):
+            for entry in pd.read_parquet(path).to_dict('records'):
+                self.entries[(entry['source'], entry['sheet'])] = entry
+
+    def file_hash(self, source):
+        '''
+            sha256 of the file content, computed at most once per run
+        '''
+        if source not in self.hashes:
+            digest = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            self.hashes[source] = digest.hexdigest()
+        return self.hashes[source]
+
+    def is_current(self, source, sheet=''):
+        entry = self.entries.get((source, sheet))
+        if entry is None or entry['pipeline_version'] != self.pipeline_version:
+            return False
+        # unchanged size and mtime is trusted, otherwise the content hash decides (e.g. a copy that only touched the file)
+        stat = os.stat(source)
+        if stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']:
+            return True
+        return self.file_hash(source) == entry['sha256']
+
+    def pending(self, source, sheets):
+        return [sheet for sheet in sheets if not self.is_current(source, sheet)]
+
+    def record(self, source, identity, sheets=None):
+        '''
+            Record the given sheets of source as parsed from the content identity (size, mtime and sha256) describes
+        '''
+        for sheet in sheets or ['']:
+            self.entries[(source, sheet)] = {
+                'source': source, 'sheet': sheet, 'size': identity['size'], 'mtime': identity['mtime'],
+                'sha256': identity['sha256'], 'pipeline_version': self.pipeline_version,
+                'processed_at': datetime.datetime.now()
+            }
+
+    def record_results(self, results):
+        '''
+            Record every successful task of a run_tasks result with the input it read and save the manifest.
+            A partial task records the sheets it transformed, a task that skipped every sheet it was given
+            records nothing
+        '''
+        for _, row in results[results['status'].isin(['ok', 'partial'])].iterrows():
+            if row['input'] is None:
+                print(f"{row['source']} was not read through open_input, it is not recorded")
+                continue
+            if row['sheets'] is None:
+                self.record(row['source'], row['input'])
+                continue
+            sheets = [sheet for sheet in row['sheets'] if sheet not in row['skipped'] and sheet not in row['failed']]
+            if sheets:
+                self.record(row['source'], row['input'], sheets)
+        self.save()
+
+    def save(self):
+        df = pd.DataFrame(list(self.entries.values()),
+                          columns=['source', 'sheet', 'size', 'mtime', 'sha256', 'pipeline_version', 'processed_at'])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        df.to_parquet(self.path + '.tmp', index=False)
+        os.replace(self.path + '.tmp', self.path)
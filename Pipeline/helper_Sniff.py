@@ -0,0 +1,283 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Sniffing Helpers
+# MAGIC Cheap pre-pass over an xlsx workbook, read straight from its XML without loading it: the sheet names, the dimension and the first rows of the first sheet and the row of the labels asked for in its first column. The sheet is only read as far as those rows and labels. Lets the drivers and transforms classify, size and reject a workbook before the full parse. Included with `%run ./helper_Sniff`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+import io
+import re
+import html
+import zipfile
+import posixpath
+from xml.etree import ElementTree
+
+# COMMAND ----------
+
+# rows of the first sheet read in full: the session header of the MED-PC wide exports and the first labels after it
+SNIFF_ROWS = 32
+# size of the pieces the sheet XML is decompressed and scanned in
+SNIFF_CHUNK_BYTES = 1 << 20
+
+# COMMAND ----------
+
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+RELATIONSHIP_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+SPREADSHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# the sheet XML is scanned with patterns over whole rows, so only the rows are matched in Python, not every cell
+ROW_PATTERN = re.compile(rb'<(?:\w+:)?row\b([^>]*?)(?:/>|>([^<]*(?:<(?!/(?:\w+:)?row>)[^<]*)*)</(?:\w+:)?row>)', re.S)
+CELL_PATTERN = re.compile(rb'<(?:\w+:)?c\b([^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+ATTRIBUTE_PATTERN = re.compile(rb'\b(r|t)="([^"]*)"')
+VALUE_PATTERN = re.compile(rb'<(?:\w+:)?v\b[^>]*>(.*?)</(?:\w+:)?v>', re.S)
+TEXT_PATTERN = re.compile(rb'<(?:\w+:)?t\b[^>]*>(.*?)</(?:\w+:)?t>', re.S)
+DIMENSION_PATTERN = re.compile(rb'<(?:\w+:)?dimension\s+ref="(?:[A-Z]+\d+:)?([A-Z]+)(\d+)"')
+COORDINATE_PATTERN = re.compile(r'([A-Z]+)(\d+)')
+
+# COMMAND ----------
+
+class WorkbookHeader:
+
+    def __init__(self, sheets, dimension, rows, labels):
+        '''
+            What the sniffing pass read of one workbook: the sheet names, the (rows, columns) dimension of the
+            first sheet, its first SNIFF_ROWS rows as sheet row -> cell values, and the first sheet row of every
+            label in its first column up to where the scan stopped (the first rows and the labels asked for)
+        '''
+        self.sheets = sheets
+        self.dimension = dimension
+        self.rows = rows
+        self.labels = labels
+
+    @property
+    def format(self):
+        '''
+            'general' for a MED-PC wide export (one label per row, opened by Filename), 'old_sa' otherwise
+        '''
+        return 'general' if list(self.labels)[:1] == ['Filename'] else 'old_sa'
+
+    def row(self, label):
+        '''
+            Cell values after the label, None when its row is not among the sniffed rows
+        '''
+        values = self.rows.get(self.labels.get(label))
+        return None if values is None else values[1:]
+
+    @property
+    def subject_columns(self):
+        '''
+            Subject columns of a wide export: up to the last filled cell of its first label row
+        '''
+        if not self.labels:
+            return 0
+        filled = [i for i, v in enumerate(self.row(next(iter(self.labels))) or []) if v is not None]
+        return filled[-1] + 1 if filled else 0
+
+# COMMAND ----------
+
+# column number (A = 1) of a cell reference
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+# part name a relationship target points to, from the folder of the part holding the relationship
+def resolve_target(folder, target):
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(folder, target))
+
+def read_relationships(archive, part):
+    folder, name = posixpath.split(part)
+    path = posixpath.join(folder, '_rels', name + '.rels')
+    if path not in archive.namelist():
+        return {}
+    root = ElementTree.fromstring(archive.read(path))
+    return {rel.get('Id'): (rel.get('Type', '').rsplit('/', 1)[-1], resolve_target(folder, rel.get('Target', '')))
+            for rel in root.iter(RELATIONSHIPS)}
+
+# sheet names in workbook order, the part of every worksheet by name and the shared strings part
+def read_workbook_parts(archive):
+    main = [target for kind, target in read_relationships(archive, '').values() if kind == 'officeDocument']
+    workbook = main[0] if main else 'xl/workbook.xml'
+    relationships = read_relationships(archive, workbook)
+    root = ElementTree.fromstring(archive.read(workbook))
+    sheets, worksheets = [], {}
+    for sheet in root.iter(SPREADSHEET + 'sheet'):
+        sheets.append(sheet.get('name'))
+        kind, target = relationships.get(sheet.get(RELATIONSHIP_ID), (None, None))
+        if kind == 'worksheet':
+            worksheets.setdefault(sheet.get('name'), target)
+    shared_strings = [target for kind, target in relationships.values() if kind == 'sharedStrings']
+    return {
+        'sheets': sheets,
+        'worksheets': worksheets,
+        'shared_strings': shared_strings[0] if shared_strings else None,
+    }
+
+# value of one cell as openpyxl gives it (numbers without a date style), shared strings as ('s', index) until resolved
+def cell_value(attributes, body):
+    kind = attributes.get(b't', b'n')
+    if body is None:
+        return None
+    if kind == b'inlineStr':
+        return html.unescape(b''.join(TEXT_PATTERN.findall(body)).decode())
+    value = VALUE_PATTERN.search(body)
+    if value is None or not value.group(1):
+        return None
+    value = html.unescape(value.group(1).decode())
+    if kind == b's':
+        return ('s', int(value))
+    if kind == b'b':
+        return bool(int(value))
+    if kind == b'n':
+        return float(value) if any(c in value for c in '.eE') else int(value)
+    return value
+
+# cell values of one row XML by column (A first), None for the missing cells. Only the first cell when first_only
+def row_values(body, first_only=False):
+    if first_only:
+        first = CELL_PATTERN.search(body)
+        cells = [first.groups()] if first else []
+    else:
+        cells = CELL_PATTERN.findall(body)
+    values, column = [], 0
+    for cell_attributes, cell_body in cells:
+        cell_attributes = dict(ATTRIBUTE_PATTERN.findall(cell_attributes))
+        coordinate = COORDINATE_PATTERN.fullmatch(cell_attributes.get(b'r', b'').decode())
+        column = column_number(coordinate.group(1)) if coordinate else column + 1
+        values += [None] * (column - len(values) - 1)
+        values.append(cell_value(cell_attributes, cell_body or None))
+    return values
+
+class SheetRows:
+
+    def __init__(self, archive, part):
+        '''
+            The rows of one sheet as (sheet row, row XML), decompressed and scanned piece by piece. The
+            (rows, columns) dimension of the sheet is known once the first row came out, None if it has none
+        '''
+        self.archive = archive
+        self.part = part
+        self.dimension = None
+
+    def __iter__(self):
+        row_counter = 0
+        pending = b''
+        with self.archive.open(self.part) as f:
+            for chunk in iter(lambda: f.read(SNIFF_CHUNK_BYTES), b''):
+                pending += chunk
+                if self.dimension is None:
+                    found = DIMENSION_PATTERN.search(pending)
+                    if found:
+                        self.dimension = (int(found.group(2)), column_number(found.group(1).decode()))
+                end = 0
+                for match in ROW_PATTERN.finditer(pending):
+                    end = match.end()
+                    attributes = dict(ATTRIBUTE_PATTERN.findall(match.group(1)))
+                    row_counter = int(attributes[b'r']) if b'r' in attributes else row_counter + 1
+                    yield row_counter, match.group(2) or b''
+                pending = pending[end:]
+
+# scan one sheet: its dimension, the cells of its first SNIFF_ROWS rows and the first row of every label in column A.
+# The first rows are the only ones parsed cell by cell, and the scan stops once they are read and every label of until
+# (as the cells hold them, see sniff_workbook) came out, so the rest of the sheet is not decompressed
+def scan_sheet(archive, part, until=()):
+    rows, labels = {}, {}
+    missing = set(until)
+    sheet_rows = SheetRows(archive, part)
+    for number, body in sheet_rows:
+        if len(rows) >= SNIFF_ROWS and not missing:
+            break
+        values = row_values(body, first_only=len(rows) >= SNIFF_ROWS)
+        if len(rows) < SNIFF_ROWS:
+            rows[number] = values
+        if values and values[0] is not None:
+            labels.setdefault(values[0], number)
+            missing.discard(values[0])
+    return sheet_rows.dimension, rows, labels
+
+# the shared strings up to the largest index used (all of them without one), read from the start of the shared strings
+# part. With until, the reading stops too once every one of these texts came out
+def read_shared_strings(archive, part, last_index=None, until=None):
+    strings = []
+    if part is None or (last_index is not None and last_index < 0):
+        return strings
+    missing = set(until) if until is not None else None
+    with archive.open(part) as f:
+        for event, element in ElementTree.iterparse(f):
+            if element.tag != SPREADSHEET + 'si':
+                continue
+            # plain text or rich text runs, the phonetic runs are not part of the value
+            texts = [element.findtext(SPREADSHEET + 't')] + [run.findtext(SPREADSHEET + 't') for run in element.iter(SPREADSHEET + 'r')]
+            strings.append(''.join([t for t in texts if t]))
+            element.clear()
+            if last_index is not None and len(strings) > last_index:
+                break
+            if missing is not None:
+                missing.discard(strings[-1])
+                if not missing:
+                    break
+    return strings
+
+# sniff one workbook given as a path, bytes or a file object, reading its first sheet up to the first SNIFF_ROWS rows
+# and the row of every one of labels. Raises ValueError when it is not a readable xlsx workbook
+@timed('sniff')
+def sniff_workbook(source, labels=()):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            parts = read_workbook_parts(archive)
+            if not parts['worksheets']:
+                return WorkbookHeader(parts['sheets'], None, {}, {})
+            # the labels asked for as the cells hold them: the index of their shared string, else their inline text
+            strings = read_shared_strings(archive, parts['shared_strings'], until=set(labels)) if labels else []
+            indexes = {}
+            for i, text in enumerate(strings):
+                indexes.setdefault(text, ('s', i))
+            until = [indexes.get(label, label) for label in labels]
+            dimension, rows, labels = scan_sheet(archive, next(iter(parts['worksheets'].values())), until)
+
+            # resolve the shared strings used by the sniffed cells and labels
+            used = [v[1] for values in rows.values() for v in values if isinstance(v, tuple)]
+            used += [label[1] for label in labels if isinstance(label, tuple)]
+            if max(used, default=-1) >= len(strings):
+                strings = read_shared_strings(archive, parts['shared_strings'], max(used))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as error:
+        raise ValueError(f'not a readable xlsx workbook ({error})')
+
+    def resolve(v):
+        return strings[v[1]] if isinstance(v, tuple) else v
+    rows = {number: [resolve(v) for v in values] for number, values in rows.items()}
+    resolved = {}
+    for label, number in labels.items():
+        resolved.setdefault(resolve(label), number)
+    count('sheets_sniffed')
+    return WorkbookHeader(parts['sheets'], dimension, rows, resolved)
+
+# uncompressed size in bytes of the XML of every worksheet of one workbook by name, read from the zip directory without
+# decompressing any sheet. Raises ValueError when it is not a readable xlsx workbook
+def sniff_sheet_sizes(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            return {ws: archive.getinfo(part).file_size for ws, part in read_workbook_parts(archive)['worksheets'].items()}
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as error:
+        raise ValueError(f'not a readable xlsx workbook ({error})')
+
+# sheet names of one workbook, read from the workbook part only. Raises ValueError when it is not a readable xlsx workbook
+def sniff_sheetnames(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            return read_workbook_parts(archive)['sheets']
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as error:
+        raise ValueError(f'not a readable xlsx workbook ({error})')
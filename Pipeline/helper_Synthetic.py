@@ -0,0 +1,246 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Synthetic Inputs
+# MAGIC Generators for lab-like input files: MED-PC `_output` workbooks (LGA, SHA, PR, SHOCK), OLD_SA multi-sheet workbooks and cohort information workbooks with their Timeline / Exit Tab sheets. Used by the benchmark notebook, included with `%run ./helper_Synthetic`
+
+# COMMAND ----------
+
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Subjects
+
+# COMMAND ----------
+
+# subject ids shared by every synthetic file, so every session finds its rfid
+def synthetic_subjects(num_subjects):
+    return ['M%d' % (100 + i) for i in range(num_subjects)]
+
+# subject -> rfid table in the layout of the RFID csv files
+def synthetic_rfid_table(subjects):
+    return pd.DataFrame({'subject': subjects, 'rfid': np.arange(len(subjects), dtype='int64') + 900000000000})
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### MED-PC sheets
+# MAGIC Every sheet is a list of rows: the label in the first cell, then one value per subject
+
+# COMMAND ----------
+
+# the numbered labels of one timestamp array (numbered from first), padded with zeros after each subject's own length
+def timestamp_rows(label, lengths, width, rng, step=10.0, first=1):
+    rows = []
+    for k in range(width):
+        values = [float(round(k * step + rng.random(), 1)) if k < length else 0 for length in lengths]
+        rows.append([label % (k + first)] + values)
+    return rows
+
+# the session header rows of an _output sheet, extra_columns subject columns past the boxes are left over by MED-PC
+def session_header_rows(subjects, extra_columns=0):
+    num_columns = len(subjects) + extra_columns
+    subjects = subjects + ['M%d' % (900 + i) for i in range(extra_columns)]
+    return [
+        ['Filename'] + ['f%d.txt' % i for i in range(num_columns)],
+        ['Experiment'] + ['exp'] * num_columns,
+        ['Group'] + ['g'] * num_columns,
+        ['Start Date'] + ['2021-01-%02d' % (1 + i % 28) for i in range(num_columns)],
+        ['End Date'] + ['2021-01-02'] * num_columns,
+        ['Subject'] + subjects,
+        ['Box'] + [i + 1 for i in range(len(subjects) - extra_columns)] + [0] * extra_columns,
+        ['Start Time'] + ['10:00:00'] * num_columns,
+        ['End Time'] + ['12:00:00'] * num_columns,
+        ['MSN'] + ['m'] * num_columns,
+        ['FR'] + [1] * num_columns,
+    ]
+
+# rows of one LGA / SHA _output sheet
+def lga_sha_output_rows(subjects, width, rng):
+    n = len(subjects)
+    rows = session_header_rows(subjects)
+    rows.append(['Active Lever Presses'] + [int(x) for x in rng.integers(5, 50, n)])
+    rows.append(['Inactive Lever Presses'] + [int(x) for x in rng.integers(0, 10, n)])
+    rows.append(['Reward'] + [int(x) for x in rng.integers(0, 5, n)])
+    for label in ['Active %d', 'Inactive %d', 'Reward %d', 'Timeout Press %d']:
+        rows += timestamp_rows(label, rng.integers(0, width + 1, n), width, rng)
+    return rows
+
+# rows of one PR _output sheet, with two left over subject columns
+def pr_output_rows(subjects, width, rng):
+    n = len(subjects) + 2
+    rows = session_header_rows(subjects, extra_columns=2)
+    rows.append(['Active Lever Presses'] + [int(x) for x in rng.integers(5, 50, n)])
+    rows.append(['Inactive Lever Presses'] + [int(x) for x in rng.integers(0, 10, n)])
+    rows.append(['Reward'] + [int(x) for x in rng.integers(0, 19, n)])
+    rows += timestamp_rows('Reward %d', rng.integers(0, width + 1, n), width, rng, step=1.0)
+    return rows
+
+# rows of one SHOCK _output sheet, with one left over subject column
+def shock_output_rows(subjects, width, rng):
+    n = len(subjects) + 1
+    rows = session_header_rows(subjects, extra_columns=1)
+    for label in ['Total Active Lever Presses', 'Total Inactive Lever Presses', 'Total Shocks', 'Total Reward', 'Rewards After First Shock']:
+        rows.append([label] + [int(x) for x in rng.integers(0, 10, n)])
+    rows += timestamp_rows('Reward # Got Shock %d', rng.integers(0, 11, n), 10, rng, step=1.0)
+    rows += timestamp_rows('Reward %d', rng.integers(0, width + 1, n), width, rng, step=7.0)
+    return rows
+
+# rows of one OLD_SA LGA / SHA sheet: U, V and Y arrays plus the timeout presses, and an all zero label
+def old_lga_sha_rows(subjects, width, rng):
+    n = len(subjects)
+    rows = [['ID'] + ['HS' + s for s in subjects]]
+    rows.append(['Active Lever Presses'] + [int(x) for x in rng.integers(5, 50, n)])
+    rows.append(['Inactive Lever Presses'] + [int(x) for x in rng.integers(0, 10, n)])
+    rows.append(['Reward'] + [int(x) for x in rng.integers(0, 5, n)])
+    for prefix in ['U', 'V', 'Y']:
+        rows += timestamp_rows(prefix + '%d', rng.integers(1, width + 1, n), width, rng, first=0)
+    lengths = rng.integers(0, width + 1, n)
+    lengths[0] = max(lengths[0], 1)
+    rows += timestamp_rows('Timeout Press %d', lengths, width, rng)
+    rows.append(['Zero'] + [0] * n)
+    return rows
+
+# rows of one OLD_SA PR sheet
+def old_pr_rows(subjects, width, rng):
+    n = len(subjects)
+    rows = [['ID'] + subjects]
+    rows.append(['Active Lever Presses'] + [int(x) for x in rng.integers(5, 50, n)])
+    rows.append(['Inactive Lever Presses'] + [int(x) for x in rng.integers(0, 10, n)])
+    rows.append(['Reward'] + [int(x) for x in rng.integers(1, 19, n)])
+    for k in range(width):
+        rows.append(['V%d' % k] + [k + 1] * n)
+    return rows
+
+# rows of one OLD_SA SHOCK sheet
+def old_shock_rows(subjects, width, rng):
+    n = len(subjects)
+    rows = [['Subject'] + subjects]
+    rows.append(['Box'] + [i + 1 for i in range(n)])
+    rows.append(['Start Time'] + ['10:00:00'] * n)
+    rows.append(['Start Date'] + ['01/02/2020'] * n)
+    for label in ['Total Active Lever Presses', 'Total Inactive Lever Presses', 'Total Shocks', 'Total Reward']:
+        rows.append([label] + [int(x) for x in rng.integers(1, 10, n)])
+    rows += timestamp_rows('Reward # Got Shock %d', rng.integers(0, 6, n), 5, rng, step=1.0)
+    rows += timestamp_rows('Reward %d', rng.integers(1, width + 1, n), width, rng, step=7.0)
+    rows.append(['Rewards After First Shock'] + [int(x) for x in rng.integers(1, 10, n)])
+    return rows
+
+# write sheets (name -> rows) into one xlsx workbook
+def write_workbook(path, sheets):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Cohort information
+
+# COMMAND ----------
+
+# Timeline sheet of one cohort: characteristics plus weight, urine and feces measurements
+def cohort_timeline(num_subjects, cohort, drug, rng):
+    n = num_subjects
+    df = pd.DataFrame({
+        'Rat': ['M%d%02d' % (cohort, i) for i in range(n)],
+        'RFID': [str(900000000000 + cohort * 1000 + i) for i in range(n)],
+        'Cohort': [cohort] * n,
+        'Sex': rng.choice(['M', 'F'], n),
+        'Experiment Group': ['A'] * n,
+        'Drug Group': [drug] * n,
+        'D.O.B': pd.to_datetime('2020-01-01') + pd.to_timedelta(rng.integers(0, 28, n), 'D'),
+        'Litter Number': rng.integers(1, 5, n),
+        'Surgeon': ['x'] * n,
+        'Handled Collection': ['ab'] * n,
+        'Arrival Date': pd.to_datetime(['2020-02-01'] * n),
+    })
+    measurements = {}
+    for k in range(1, 13):
+        measurements['Weight %d Value' % k] = rng.integers(200, 300, n).astype(float)
+        measurements['Weight %d Date' % k] = pd.to_datetime(['2020-03-%02d' % k] * n)
+    for name in ['Urine', 'Feces']:
+        for k in range(1, 5):
+            measurements['%s %d Date' % (name, k)] = pd.to_datetime(['2020-04-%02d' % k] * n)
+            measurements['%s %d Collection' % (name, k)] = ['t%d' % k] * n
+    return pd.concat([df, pd.DataFrame(measurements)], axis=1)
+
+# Exit Tab sheet of one cohort, every third rat is listed twice
+def cohort_exit_tab(timeline):
+    rows = []
+    for i, (rat, rfid, cohort) in enumerate(zip(timeline['Rat'], timeline['RFID'], timeline['Cohort'])):
+        rows.append({'Rat': rat, 'Cohort': cohort, 'RFID': rfid, 'Exit Day': pd.Timestamp('2020-05-01'),
+                     'Exit Code': 'E%d' % i, 'Exit Notes': 'n%d' % i, 'Complete': 'yes'})
+        if i % 3 == 0:
+            rows.append({'Rat': rat, 'Cohort': cohort, 'RFID': rfid, 'Exit Day': pd.Timestamp('2020-05-02'),
+                         'Exit Code': 'F%d' % i, 'Exit Notes': 'm%d' % i, 'Complete': 'yes'})
+    return pd.DataFrame(rows)
+
+# write one cohort information workbook, the cocaine ones name their first sheet Timeline
+def write_cohort_workbook(path, num_subjects, cohort, drug, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    timeline = cohort_timeline(num_subjects, cohort, drug, rng)
+    with pd.ExcelWriter(path) as writer:
+        timeline.to_excel(writer, sheet_name='Timeline' if drug == 'cocaine' else 'Information Sheet', index=False)
+        cohort_exit_tab(timeline).to_excel(writer, sheet_name='Exit Tab', index=False)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Input tree
+
+# COMMAND ----------
+
+# MED-PC _output sheets by experiment type
+OUTPUT_ROWS = {'LGA': lga_sha_output_rows, 'SHA': lga_sha_output_rows, 'PR': pr_output_rows, 'SHOCK': shock_output_rows}
+
+# write a whole synthetic input tree under root. Every experiment type gets num_files _output files and one OLD_SA
+# workbook of num_files sheets, every drug num_cohorts cohort workbooks, all of num_subjects subjects and timestamp
+# arrays of up to width values. Returns the subject table and the inputs of every benchmark case as
+# case -> list of (args, rows), rows being the subject sessions (or cohort subjects) the args hold
+def make_synthetic_inputs(root, num_files=4, num_subjects=16, width=50, num_cohorts=2, seed=0):
+    rng = np.random.default_rng(seed)
+    subjects = synthetic_subjects(num_subjects)
+    cases = {}
+
+    for kind, make_rows in OUTPUT_ROWS.items():
+        cases[kind] = []
+        for i in range(num_files):
+            cohort, trial = 1 + i // 99, 1 + i % 99
+            if kind == 'PR':
+                path = os.path.join(root, kind, 'coc', 'C%02dHSPR%02d_output.xlsx' % (cohort, trial))
+            elif kind == 'SHOCK':
+                path = os.path.join(root, kind, 'C%02dHSSHOCK%02d_output.xlsx' % (cohort, trial))
+            else:
+                path = os.path.join(root, kind, 'C%02dHS%s%02d_output.xlsx' % (cohort, kind, trial))
+            write_workbook(path, {'Sheet': make_rows(subjects, width, rng)})
+            cases[kind].append(((path,), num_subjects))
+
+    old_sheets = {
+        'OLD_SA_LGA': ('OLD_SA_LGA.xlsx', 'C%02dHSLGA%02d_20200101', old_lga_sha_rows),
+        'OLD_SA_PR': ('OLD_SA_PR.xlsx', 'C%02dHSPR%02d_20200101', old_pr_rows),
+        'OLD_SA_SHOCK': ('C02_sa.xlsx', 'SHOCK%02d_%03d', old_shock_rows),
+    }
+    for case, (file_name, sheet_name, make_rows) in old_sheets.items():
+        path = os.path.join(root, case, file_name)
+        sheets = {sheet_name % (1 + i // 99, 1 + i % 99): make_rows(subjects, width, rng) for i in range(num_files)}
+        write_workbook(path, sheets)
+        cases[case] = [((path, list(sheets)), num_subjects * num_files)]
+
+    cases['COHORT'] = []
+    for drug in ['cocaine', 'oxycodone']:
+        for cohort in range(1, num_cohorts + 1):
+            path = os.path.join(root, 'COHORT', drug, 'C%02d.xlsx' % cohort)
+            write_cohort_workbook(path, num_subjects, cohort, drug, rng)
+            cases['COHORT'].append(((path, drug), num_subjects))
+
+    return synthetic_rfid_table(subjects), cases
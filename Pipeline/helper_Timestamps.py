@@ -0,0 +1,124 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC ## Timestamp Helpers
+# MAGIC Shared NumPy routines for the MED-PC array blocks (Active 1..N, Reward 1..N, ...). Included by the process notebooks with `%run ./helper_Timestamps`
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+import pandas as pd
+import numpy as np
+
+# COMMAND ----------
+
+# trim the trailing zero padding of every row of a 2-D timestamp block in one vectorized pass.
+# returns the kept values flattened row by row plus the row offsets into them, so row i is values[offsets[i]:offsets[i+1]]
+@timed('group_timestamps')
+def trim_timestamp_block(block, integer=False):
+    block = pd.DataFrame(block).to_numpy(dtype=np.float64, na_value=np.nan)
+    num_rows, width = block.shape
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    if width == 0:
+        return offsets, np.zeros(0, dtype=np.int64 if integer else np.float64)
+
+    # a row ends just after its last non-zero cell, empty cells count as padding
+    kept = (block != 0) & ~np.isnan(block)
+    ends = np.where(kept.any(axis=1), width - np.argmax(kept[:, ::-1], axis=1), 0)
+    np.cumsum(ends, out=offsets[1:])
+    values = block[np.arange(width) < ends[:, None]]
+
+    if integer and not np.isnan(values).any():
+        values = values.astype(np.int64)
+    return offsets, values
+
+# number of kept datapoints in every row of a trimmed block
+def count_ragged(offsets):
+    return np.diff(offsets)
+
+# split a trimmed block into one array per row (views into values, no copy), None for empty rows
+def split_ragged(offsets, values):
+    return [values[offsets[i]:offsets[i+1]] if offsets[i+1] > offsets[i] else None
+            for i in range(len(offsets) - 1)]
+
+# serialize a column of per-row arrays into space separated strings, None for empty rows
+def serialize_arrays(cells):
+    return [" ".join(c.astype(str)) if c is not None else None for c in cells]
+
+# COMMAND ----------
+
+# session metrics of the event arrays, in the units of the timestamps: events closer than BURST_MAX_GAP to the one
+# before chain into a burst, a burst counts from BURST_MIN_EVENTS events on, and the rate curve counts the events
+# of every RATE_BIN_WIDTH bin from the session start up to the bin of the last event
+BURST_MAX_GAP = 60
+BURST_MIN_EVENTS = 3
+RATE_BIN_WIDTH = 600
+# metric columns event_metrics gives for every event array, after its prefix
+EVENT_METRICS = ['latency', 'iri_mean', 'iri_median', 'bursts', 'rate_curve']
+
+# COMMAND ----------
+
+# pack one column of per-row arrays (None for empty rows) back into row offsets and flattened values
+def pack_ragged(cells):
+    counts = np.array([0 if c is None else len(c) for c in cells], dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    values = [np.asarray(c, dtype=np.float64) for c in cells if c is not None and len(c)]
+    return offsets, np.concatenate(values) if values else np.zeros(0, dtype=np.float64)
+
+# session metrics of every row of a trimmed event block (see trim_timestamp_block), all rows at once: the time of the
+# first event, the mean and median inter-response interval, the number of bursts and the rate curve (one array of
+# counts per row, None for rows without events). Rows without enough events get NaN
+@timed('event_metrics')
+def event_metrics(offsets, values):
+    values = np.asarray(values, dtype=np.float64)
+    num_rows = len(offsets) - 1
+    counts = np.diff(offsets)
+    rows = np.repeat(np.arange(num_rows), counts)
+    has_events = counts > 0
+
+    latency = np.full(num_rows, np.nan)
+    latency[has_events] = values[offsets[:-1][has_events]]
+
+    # inter-response intervals, the pairs of events within one row
+    same_row = rows[1:] == rows[:-1]
+    intervals = np.diff(values)[same_row]
+    interval_rows = rows[1:][same_row]
+    num_intervals = np.bincount(interval_rows, minlength=num_rows)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        iri_mean = np.bincount(interval_rows, weights=intervals, minlength=num_rows) / num_intervals
+    # medians from the intervals sorted within every row
+    iri_median = np.full(num_rows, np.nan)
+    ordered = intervals[np.lexsort((intervals, interval_rows))]
+    starts = np.concatenate([[0], np.cumsum(num_intervals)[:-1]])
+    kept = num_intervals > 0
+    low = starts[kept] + (num_intervals[kept] - 1) // 2
+    high = starts[kept] + num_intervals[kept] // 2
+    iri_median[kept] = (ordered[low] + ordered[high]) / 2
+
+    # a burst starts at the first event of a row and after every gap longer than BURST_MAX_GAP
+    breaks = np.ones(len(values), dtype=bool)
+    breaks[1:] = ~same_row | (np.diff(values) > BURST_MAX_GAP)
+    chain_lengths = np.bincount(np.cumsum(breaks) - 1) if len(values) else np.zeros(0, dtype=np.int64)
+    bursts = np.bincount(rows[breaks][chain_lengths >= BURST_MIN_EVENTS], minlength=num_rows)
+
+    # rate curves laid out one after the other, each as long as the bin of its last event. Events without a finite
+    # time (NaN cells of the block) fall in no bin
+    finite = np.isfinite(values)
+    bins = np.maximum(values[finite] // RATE_BIN_WIDTH, 0).astype(np.int64)
+    binned_rows = rows[finite]
+    curve_lengths = np.zeros(num_rows, dtype=np.int64)
+    np.maximum.at(curve_lengths, binned_rows, bins + 1)
+    curve_offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(curve_lengths, out=curve_offsets[1:])
+    curves = np.bincount(curve_offsets[:-1][binned_rows] + bins, minlength=curve_offsets[-1]).astype(np.int32)
+
+    return {
+        'latency': latency,
+        'iri_mean': iri_mean,
+        'iri_median': iri_median,
+        'bursts': bursts,
+        'rate_curve': split_ragged(curve_offsets, curves),
+    }
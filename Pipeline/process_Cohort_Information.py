@@ -5,9 +5,13 @@
 # COMMAND ----------
 
 import os
+import io
+import time
 import pandas as pd
 import numpy as np
 import psycopg2
+from psycopg2 import pool, sql
+from contextlib import contextmanager
 import math
 from collections import defaultdict
 from datetime import date, datetime
@@ -16,6 +20,15 @@ from os.path import isfile, join
 
 # COMMAND ----------
 
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Metrics
+
+# COMMAND ----------
+
+
 # MAGIC %md
 # MAGIC #### Config file for reading in csv files and accessing DB
 # MAGIC Previosuly the config.py file
@@ -79,15 +92,29 @@ integer_columns = ['rfid','cohort','box','active_lever_presses','inactive_lever_
 COCAINE_COHORT_DIR_FILEPATH = '/dbfs/mnt/testmount/input/cohort_information/cocaine_cohort_information'
 OXY_COHORT_DIR_FILEPATH = '/dbfs/mnt/testmount/input/cohort_information/oxy_cohort_information'
 
-COCAINE_COHORT_ALL = [join(COCAINE_COHORT_DIR_FILEPATH, f) for f in listdir(COCAINE_COHORT_DIR_FILEPATH) if isfile(join(COCAINE_COHORT_DIR_FILEPATH, f))]
-
-OXYCODONE_COHORT_ALL = [join(OXY_COHORT_DIR_FILEPATH, f) for f in listdir(OXY_COHORT_DIR_FILEPATH) if isfile(join(OXY_COHORT_DIR_FILEPATH, f))]
+# all the cohort information files of one folder, listed when the run starts
+def list_cohort_files(dir_filepath):
+    return [join(dir_filepath, f) for f in listdir(dir_filepath) if isfile(join(dir_filepath, f))]
 
 SUBJECT_OUTPUT_FILEPATH = '/dbfs/mnt/testmount/output/Cohort_Information/Subject/cohort_subject.csv'
 MEASUREMENT_OUTPUT_FILEPATH = '/dbfs/mnt/testmount/output/Cohort_Information/Measurement/cohort_measurement.csv'
 
 CHARACTERISTIC_TABLE_NAME = 'subject'
 MEASUREMENT_TABLE_NAME = 'measurement'
+
+# database the subject and measurement tables are loaded into at the end of a run, no load when DATABASE_HOST is None
+DATABASE_HOST = None
+DATABASE_PORT = 5432
+DATABASE_NAME = ''
+DATABASE_USERNAME = ''
+DATABASE_PASSWORD = ''
+DATABASE_SCHEMA = 'public'
+# connections kept by the pool and rows sent per COPY batch
+DATABASE_POOL_SIZE = 2
+COPY_BATCH_ROWS = 50000
+# unique keys the staged rows are merged on, the other columns of a row already loaded are updated
+CHARACTERISTIC_CONFLICT_COLS = ['rfid']
+MEASUREMENT_CONFLICT_COLS = ['rfid', 'measurement_name', 'measure_number']
 # These are all the columns that will be accessed for its value to be inserted into its respective column in the
 # characteristic table
 cocaine_characteristics_list = [
@@ -428,26 +455,91 @@ df_measurement.to_csv(MEASUREMENT_OUTPUT_FILEPATH, index=False)
 
 # COMMAND ----------
 
-# class Pipeline(object):
+class Pipeline(object):
 
-#     def __init__(self):
-#         self.conn, self.cur = self.connect_db()
-
-#     @staticmethod
-#     def connect_db():        
-#         try:
-#             conn = psycopg2.connect(user=DATABASE_USERNAME,
-#                                     password=DATABASE_PASSWORD,
-#                                     host=DATABASE_HOST,
-#                                     port=DATABASE_PORT,
-#                                     database=DATABASE_NAME,
-#                                     options=f'-c search_path={DATABASE_SCHEMA}'
-#                                     )
-#             cur = conn.cursor()
-#         except Exception as error:
-#             print(f'Cannot connect to DB due to "{error}" error')
+    def __init__(self, minconn=1, maxconn=DATABASE_POOL_SIZE):
+        '''
+            Small pool of connections to the database, shared by every load of the run
+        '''
+        self.pool = pool.ThreadedConnectionPool(minconn, maxconn,
+                                                user=DATABASE_USERNAME,
+                                                password=DATABASE_PASSWORD,
+                                                host=DATABASE_HOST,
+                                                port=DATABASE_PORT,
+                                                database=DATABASE_NAME,
+                                                options=f'-c search_path={DATABASE_SCHEMA} -c datestyle=ISO,MDY'
+                                                )
+
+    @contextmanager
+    def connection(self):
+        '''
+            Borrow a pooled connection for one transaction: committed when the block succeeds, rolled back otherwise
+        '''
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def close(self):
+        self.pool.closeall()
 
-#         return (conn, cur)
+    @staticmethod
+    def copy_buffer(df: pd.DataFrame):
+        '''
+            CSV text of one batch for COPY. Null values become empty unquoted fields (NULL) and float columns
+            holding whole numbers are written without the trailing .0 so they load into integer columns
+        '''
+        df = df.copy()
+        for col in df.columns:
+            values = df[col]
+            if values.dtype.kind == 'f' and ((values % 1 == 0) | values.isna()).all():
+                df[col] = values.astype('Int64')
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        return buffer
+
+    def load_table(self, df: pd.DataFrame, table_name, columns, conflict_columns, batch_rows=COPY_BATCH_ROWS):
+        '''
+            Stream df in batches through COPY FROM STDIN into a temporary staging table shaped like table_name,
+            then merge everything into the table with one INSERT ... ON CONFLICT DO UPDATE: a row already in the
+            table (same conflict_columns) takes the other columns of the staged row, so a corrected cohort sheet
+            updates the rows loaded before. Within df the last row of every key wins
+        '''
+        staging = f'staging_{table_name}'
+        df = df.drop_duplicates(subset=conflict_columns, keep='last')
+        column_list = sql.SQL(',').join(map(sql.Identifier, columns))
+        conflict_list = sql.SQL(',').join(map(sql.Identifier, conflict_columns))
+        updates = [col for col in columns if col not in conflict_columns]
+        if updates:
+            action = sql.SQL('DO UPDATE SET {}').format(sql.SQL(',').join(
+                [sql.SQL('{} = EXCLUDED.{}').format(sql.Identifier(col), sql.Identifier(col)) for col in updates]))
+        else:
+            action = sql.SQL('DO NOTHING')
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql.SQL('CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP').format(
+                sql.Identifier(staging), sql.Identifier(table_name)))
+            copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '')").format(
+                sql.Identifier(staging), column_list).as_string(conn)
+            for start in range(0, len(df), batch_rows):
+                cur.copy_expert(copy, self.copy_buffer(df[columns].iloc[start:start + batch_rows]))
+            cur.execute(sql.SQL('INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) {}').format(
+                sql.Identifier(table_name), column_list, column_list, sql.Identifier(staging), conflict_list, action))
+            loaded = cur.rowcount
+        print(f'{loaded} of {len(df)} rows inserted or updated in {table_name}')
+        return loaded
+
+    def load_cohort_tables(self, df_subject: pd.DataFrame, df_measurement: pd.DataFrame):
+        '''
+            Load the subject table, then the measurements that refer to it
+        '''
+        self.load_table(df_subject, CHARACTERISTIC_TABLE_NAME, characteristic_table_cols, CHARACTERISTIC_CONFLICT_COLS)
+        self.load_table(df_measurement, MEASUREMENT_TABLE_NAME, measurement_table_cols, MEASUREMENT_CONFLICT_COLS)
 
 # COMMAND ----------
 
@@ -478,16 +570,8 @@ class Subject:
         for col in characteristic_table_cols:
             self.characteristics[col] = []
 
-        self.measurements = list()
-        # Separate measurement list for the different drugs as their frequency of occurrence differs slightly
-        self.measurement_cols = cocaine_measurements_list if type == 'cocaine' else oxycodone_measurements_list
         self.subject_row = subject_row
         self.type = type
-
-        # Used later to create a dataframe out of the dict to append to csv file
-        self.measure_df_mapping = {}
-        for col in measurement_table_cols:
-            self.measure_df_mapping[col] = []
         # super().__init__()
         # self.conn, self.cur = Pipeline.connect_db()
 
@@ -513,50 +597,6 @@ class Subject:
         # for k, v in self.characteristics.items():
         #     print(f'{k}' + ' --> ' + f'{v}')
 
-    def process_measurements(self):
-        '''
-            Get all information that is repeated measured (for a possibly arbitrary number of times) - weights, feces, etc
-        '''
-
-        for measurement_dict in self.measurement_cols:
-    
-            counts = measurement_dict['counts']
-            suffixes = measurement_dict['col_suffix']
-
-            # Loop through each count of the measurement
-            for count_num in counts:
-
-                # Use default dict as we will need all access all values to insert into database
-                insert_dict = defaultdict(lambda: None)
-                col_name = measurement_dict['col_name']
-                current_number = count_num
-
-                insert_dict['rfid'] = self.subject_row.get('rfid')
-                insert_dict['measurement_name'] = measurement_dict['measurement_name']
-                insert_dict['measure_number'] = current_number
-                insert_dict['drug_group'] = self.type
-                insert_dict['cohort'] = self.subject_row.get('cohort')
-                
-                for suffix in suffixes:
-                    # This is used to query for the value of a specific column referencing a measurement value for the current subject (row)
-                    full_col_name = ' '.join([col_name, str(current_number), suffix]).strip()
-                    full_col_name = full_col_name.lower()
-                    if suffix == 'Value' or suffix == 'Analysis':
-                        m_val =  self.subject_row.get(full_col_name, default=None)
-                        insert_dict['measurement_value'] = int(m_val) if not math.isnan(m_val) else None
-                    elif suffix == 'By' or suffix == 'Collection':
-                        # Storing multiple technicians as csv for ease of reversal
-                        insert_dict['technician'] = self.subject_row.get(full_col_name)
-                    elif suffix == 'Date':
-                        insert_dict['date_measured'] = self.format_date(self.subject_row.get(full_col_name))
-                # 
-                for col in measurement_table_cols:
-                    self.measure_df_mapping[col].append(insert_dict[col])
-                # self.measurements.append(insert_dict)
-        # for k, v in self.measure_df_mapping.items():
-        #     print(f'{k}' + ' --> ' + f'{v}')
-        return 
-
     @staticmethod
     def format_date(date: datetime):
         '''
@@ -598,20 +638,56 @@ class Subject:
         return sql_string_values
 
     def insert_characteristics(self):
-        df = pd.DataFrame(self.characteristics)
-        append_to = pd.read_csv(SUBJECT_OUTPUT_FILEPATH)
-        append_to = pd.concat([append_to, df], axis=0)
-        append_to.to_csv(SUBJECT_OUTPUT_FILEPATH, mode="w", index=False, header=True)
+        # append in the column order of the header written at start up, without re-reading the file
+        df = pd.DataFrame(self.characteristics, columns=characteristic_table_cols)
+        df.to_csv(SUBJECT_OUTPUT_FILEPATH, mode="a", index=False, header=False)
         print("Characteristic data Appended Successfully")
 
-    def insert_measurements(self):
-        # for k, arr in self.measure_df_mapping.items():
-        #     print(f'Arr has length of {len(arr)} with the key {k} and the arr {arr}')
-        df = pd.DataFrame(self.measure_df_mapping)
-        append_to = pd.read_csv(MEASUREMENT_OUTPUT_FILEPATH)
-        append_to = pd.concat([append_to, df], axis=0)
-        append_to.to_csv(MEASUREMENT_OUTPUT_FILEPATH, mode="w", index=False, header=True)
-        print("Measurement data Appended Successfully")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ### Class to collect the subject and measurement tables of a whole run
+# MAGIC Batch mode: every subject of every cohort is buffered column by column and each table is written once at the end
+
+# COMMAND ----------
+
+class CohortTables:
+
+    def __init__(self):
+        '''
+            Columnar buffers for the subject (characteristic) and measurement tables
+        '''
+        self.characteristics = {col: [] for col in characteristic_table_cols}
+        self.measurements = {col: [] for col in measurement_table_cols}
+
+    def add_characteristics(self, subject: Subject):
+        '''
+            Add the processed characteristics of one subject
+        '''
+        for col in characteristic_table_cols:
+            self.characteristics[col].extend(subject.characteristics[col])
+
+    def add_measurements(self, df: pd.DataFrame):
+        '''
+            Add the long measurement table of one cohort
+        '''
+        for col in measurement_table_cols:
+            self.measurements[col].extend(df[col].tolist())
+
+    @timed('write')
+    def write(self):
+        '''
+            Write both tables in one go, replacing the files, and return them
+        '''
+        df_subject = pd.DataFrame(self.characteristics, columns=characteristic_table_cols)
+        df_measurement = pd.DataFrame(self.measurements, columns=measurement_table_cols)
+        df_subject.to_csv(SUBJECT_OUTPUT_FILEPATH, mode="w", index=False, header=True)
+        df_measurement.to_csv(MEASUREMENT_OUTPUT_FILEPATH, mode="w", index=False, header=True)
+        count('rows_out', len(df_subject) + len(df_measurement))
+        count('files_written', 2)
+        print(f'{len(df_subject)} subjects and {len(df_measurement)} measurements written')
+        return df_subject, df_measurement
 
 
 # COMMAND ----------
@@ -629,37 +705,47 @@ class CohortProcess:
         self.cohort_subjects = []
         self.subjects = []
         self.type = type
-        if type == 'cocaine':
-            self.df_sheets = pd.read_excel(self.excel_filepath, sheet_name = ['Timeline','Exit Tab'], converters = cocaine_excel_converters)
-        else:
-            self.df_sheets = pd.read_excel(self.excel_filepath, sheet_name = None, converters = oxycodone_excel_converters)
+        count('bytes_read', os.path.getsize(self.excel_filepath))
+        with span('read'):
+            if type == 'cocaine':
+                self.df_sheets = pd.read_excel(self.excel_filepath, sheet_name = ['Timeline','Exit Tab'], converters = cocaine_excel_converters)
+            else:
+                self.df_sheets = pd.read_excel(self.excel_filepath, sheet_name = None, converters = oxycodone_excel_converters)
+        count('sheets_parsed', len(self.df_sheets))
         self.df_timeline = self.get_df_excel_file(self.df_sheets['Timeline']) if 'Timeline' in self.df_sheets.keys() else self.get_df_excel_file(self.df_sheets['Information Sheet'])
         self.df_exit_tab = self.get_df_excel_file(self.df_sheets['Exit Tab'])
         self.df_exit_tab = self.df_exit_tab.drop(['rat', 'cohort'], axis=1)
         self.df_exit_tab = self.organize_exit_tabs(self.df_exit_tab)
 
         self.df_final = pd.merge(self.df_timeline, self.df_exit_tab, how='left', on='rfid')
+        count('rows_in', len(self.df_final))
 
+    @timed('exit_tabs')
     def organize_exit_tabs(self, df):
-        col = df.columns
+        '''
+            Consolidate the exit tab entries of RFIDs listed more than once into one row, in one groupby pass:
+            the first entry is kept and its string fields get the differing strings of the other entries
+            appended (', ' separated, in order of appearance). Consolidated rows go after the single entries
+        '''
+        duplicated = df['rfid'].duplicated(keep=False)
+        if not duplicated.any():
+            return df
+        dups = df[duplicated]
+        merged = dups.drop_duplicates(subset='rfid', keep='first').copy()
 
-        out = []
-        for rfid in df['rfid'].unique():
-            if sum(df['rfid']==rfid)==1:
+        for col in df.columns:
+            if col == 'rfid' or dups[col].dtype != object:
                 continue
-            db = df[df['rfid']==rfid]
-            sampdf = {}
-            for i in col:
-                sampdf[i] = db.iloc[0][i]
-            for n in range(1,len(db)):
-                for i in col:
-                    if type(sampdf[i]) == str and type(db.iloc[n][i]) == str and sampdf[i] != db.iloc[n][i]:
-                        sampdf[i] = sampdf[i]+', '+db.iloc[1][i]
-            out.append(pd.DataFrame(sampdf, index=[db.index[0]]))
-            df = df.drop(db.index)
-        if len(out) == 0:
-            return df
-        return df.append(pd.concat(out))
+            is_str = dups[col].map(type) == str
+            strings = dups.loc[is_str, ['rfid', col]].drop_duplicates()
+            # ', ' in front of every string but the first of its rfid, then one grouped concatenation
+            separators = np.where(strings.groupby('rfid', sort=False).cumcount() == 0, '', ', ')
+            pieces = pd.Series(separators + strings[col].to_numpy(dtype=object), index=strings.index)
+            joined = pieces.groupby(strings['rfid'], sort=False).sum()
+            first_is_str = merged[col].map(type) == str
+            merged.loc[first_is_str, col] = merged.loc[first_is_str, 'rfid'].map(joined)
+
+        return pd.concat([df[~duplicated], merged])
  
     def get_df_excel_file(self, df: pd.DataFrame):
         '''
@@ -672,25 +758,91 @@ class CohortProcess:
         df.columns = df.columns.str.lower()
         list_date_cols = [col for col in df.columns if any(match in col.lower() for match in ['date', 'day'])]
         list_collection_cols = [col for col in df.columns if any(match in col.lower() for match in ['collection'])]
-        df[list_date_cols] = df[list_date_cols].apply(pd.to_datetime, errors='coerce')
+        df[list_date_cols] = df[list_date_cols].apply(self.coerce_dates)
         df[list_collection_cols] = df[list_collection_cols].astype(str)
         return df
 
-    def insert_subject(self, subject: Subject):
+    @staticmethod
+    def coerce_dates(values: pd.Series):
+        '''
+            Convert a column into datetime objects, like pd.to_datetime with errors='coerce'. The filled cells that
+            are not dates are printed and counted (values_coerced) before they are left empty
+        '''
+        parsed = pd.to_datetime(values, errors='coerce')
+        coerced = int((parsed.isna() & values.notna()).sum())
+        if coerced:
+            print(f'{coerced} {values.name} values are not dates and are left empty')
+            count('values_coerced', coerced)
+        return parsed
+
+    def extract_measurements(self):
+        '''
+            Long measurement table (measurement_table_cols) of the whole cohort. Every output field is gathered as one
+            subjects x (measurement, count) matrix from the "<measurement> <count> <suffix>" columns and raveled
+            subject by subject, in the order the per subject loop produced. Missing columns give empty values
+        '''
+        measurement_cols = cocaine_measurements_list if self.type == 'cocaine' else oxycodone_measurements_list
+        df = self.df_final
+        pairs = [(measurement_dict, count_num) for measurement_dict in measurement_cols for count_num in measurement_dict['counts']]
+        num_subjects = len(df)
+
+        def gather(field_suffixes):
+            columns = []
+            for measurement_dict, count_num in pairs:
+                column = np.full(num_subjects, None, dtype=object)
+                for suffix in measurement_dict['col_suffix']:
+                    full_col_name = ' '.join([measurement_dict['col_name'], str(count_num), suffix]).strip().lower()
+                    if suffix in field_suffixes and full_col_name in df.columns:
+                        column = df[full_col_name].to_numpy(dtype=object)
+                columns.append(column)
+            return np.column_stack(columns).ravel() if pairs else np.zeros(0, dtype=object)
+
+        values = pd.to_numeric(pd.Series(gather(['Value', 'Analysis'])), errors='coerce')
+        dates = self.coerce_dates(pd.Series(gather(['Date']), name='date_measured'))
+        technicians = pd.Series(gather(['By', 'Collection']))
+
+        out = pd.DataFrame({
+            'rfid': np.repeat(df['rfid'].to_numpy(dtype=object), len(pairs)),
+            'measurement_name': np.tile([measurement_dict['measurement_name'] for measurement_dict, _ in pairs], num_subjects),
+            'measurement_value': np.trunc(values).astype('Int64').astype(object).where(values.notna(), None),
+            'drug_group': self.type,
+            'cohort': np.repeat(df['cohort'].to_numpy(dtype=object), len(pairs)) if 'cohort' in df.columns else None,
+            'measure_number': np.tile([count_num for _, count_num in pairs], num_subjects),
+            'date_measured': dates.dt.strftime("%m/%d/%Y %H:%M:%S").where(dates.notna(), None),
+            'technician': technicians,
+        }, columns=measurement_table_cols)
+        return out
+
+    def insert_measurements(self, df: pd.DataFrame):
+        # append in the column order of the header written at start up, without re-reading the file
+        df.to_csv(MEASUREMENT_OUTPUT_FILEPATH, mode="a", index=False, header=False)
+        print("Measurement data Appended Successfully")
+
+    def insert_subject(self, subject: Subject, tables: CohortTables = None):
         subject.process_characteristics()
-        subject.insert_characteristics()
-        subject.process_measurements()
-        subject.insert_measurements()
+        if tables is None:
+            subject.insert_characteristics()
+        else:
+            tables.add_characteristics(subject)
 
-    def insert_cohort(self):
+    def insert_cohort(self, tables: CohortTables = None):
         '''
-            Loop through all subjects of the cohort and insert them into the database
+            Loop through all subjects of the cohort and insert them into the database,
+            or into the batch buffers when tables is given. Measurements are extracted for the whole cohort at once
         '''
         
-        for index, subject_row in self.df_final.iterrows():
-            print(subject_row)
-            subject = Subject(subject_row, self.type)
-            self.insert_subject(subject)
+        with span('characteristics'):
+            for index, subject_row in self.df_final.iterrows():
+                print(subject_row)
+                subject = Subject(subject_row, self.type)
+                self.insert_subject(subject, tables)
+
+        with span('measurements'):
+            df_measurement = self.extract_measurements()
+        if tables is None:
+            self.insert_measurements(df_measurement)
+        else:
+            tables.add_measurements(df_measurement)
             # subject.conn.close()
 
 # COMMAND ----------
@@ -716,17 +868,42 @@ RFID_COC = rfid_df('')
 
 # COMMAND ----------
 
+# process one cohort file into the run tables, as one task of the run log
+def process_cohort_file(filepath, type, tables, records):
+    start = time.time()
+    with task_metrics('CohortProcess', filepath) as metrics:
+        cohort = CohortProcess(filepath, type)
+        cohort.insert_cohort(tables)
+    records.append(metrics.record('ok', time.time() - start))
+
 def main():
-    for cocaine_cohort in COCAINE_COHORT_ALL:
+    tables = CohortTables()
+    records = []
+    for cocaine_cohort in list_cohort_files(COCAINE_COHORT_DIR_FILEPATH):
         print(f'NAME OF THE COCAINE COHORT IS: {cocaine_cohort}')
-        cohort = CohortProcess(cocaine_cohort, "cocaine")
-        cohort.insert_cohort()
+        process_cohort_file(cocaine_cohort, "cocaine", tables, records)
         RFID_COC.add(cocaine_cohort)
-    for oxy_cohort in OXYCODONE_COHORT_ALL:
+    for oxy_cohort in list_cohort_files(OXY_COHORT_DIR_FILEPATH):
         print(f'NAME OF THE OXY COHORT IS: {oxy_cohort}')
-        cohort = CohortProcess(oxy_cohort, "oxycodone")
-        cohort.insert_cohort()
+        process_cohort_file(oxy_cohort, "oxycodone", tables, records)
         RFID_OXY.add(oxy_cohort)
     RFID_OXY.save()
     RFID_COC.save()
+
+    start = time.time()
+    with task_metrics('CohortTables.write', SUBJECT_OUTPUT_FILEPATH) as metrics:
+        df_subject, df_measurement = tables.write()
+        if PARQUET_OUTPUT_ROOT is not None:
+            with span('write'):
+                write_parquet_dataset(df_subject, CHARACTERISTIC_TABLE_NAME, 'cohort_subject', partition_cols=['drug_group', 'cohort'])
+                write_parquet_dataset(df_measurement, MEASUREMENT_TABLE_NAME, 'cohort_measurement', partition_cols=['drug_group', 'cohort'])
+        if DATABASE_HOST is not None:
+            pipeline = Pipeline()
+            try:
+                with span('database'):
+                    pipeline.load_cohort_tables(df_subject, df_measurement)
+            finally:
+                pipeline.close()
+    records.append(metrics.record('ok', time.time() - start))
+    write_run_log(records, new_run_id())
 main()
@@ -7,11 +7,23 @@ import io
 
 # COMMAND ----------
 
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Runner
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ## Configs
 
 # COMMAND ----------
 
+TABLE_NAME = 'irritability'
+PIPELINE_VERSION = '1'
+MANIFEST_PATH = '/dbfs/mnt/testmount/output/manifest/IRR.parquet'
+
 characteristics_IRR = [
  'subject',
  'rfid',
@@ -52,6 +64,11 @@ characteristics_IRR = [
  'diff_ave_agg',
  'diff_ave_total']
 
+# the labels and the scorers are text, the scores numbers
+OUTPUT_SCHEMAS[TABLE_NAME] = pa.schema(
+    [(col, pa.string() if col in ['subject', 'sex', 'exp_group'] or 'scorer' in col else
+      pa.int64() if col in ['rfid', 'cohort'] else pa.float64()) for col in characteristics_IRR])
+
 # COMMAND ----------
 
 # MAGIC %md
@@ -59,18 +76,20 @@ characteristics_IRR = [
 
 # COMMAND ----------
 
-def transformed_irr(filepath):
+def transformed_irr(filepath, content=None):
     print(filepath)
-    with open(filepath, "rb") as f:
-        file_content = f.read()
     # Load the binary data into a pandas DataFrame
-    df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
-    for col in df.columns:
-        if col in ['rat','sex','group'] or 'scorer' in col:
-            df[col] = df[col].fillna('N/A')
+    with span('read'), open_input(filepath, content) as source:
+        df = pd.read_excel(source, engine='openpyxl')
+    count('sheets_parsed')
+    count('rows_in', len(df))
+    with span('coerce'):
+        for col in df.columns:
+            if col in ['rat','sex','group'] or 'scorer' in col:
+                df[col] = df[col].fillna('N/A')
     df.columns = characteristics_IRR
     output_path = ''
-    df.to_csv(os.path.join(output_path, f.name.split('/')[-1].split('.')[0] + '.csv'), index=False)
+    write_output(df, output_path, filepath.split('/')[-1].split('.')[0], TABLE_NAME)
 
 # COMMAND ----------
 
@@ -79,9 +98,16 @@ def transformed_irr(filepath):
 
 # COMMAND ----------
 
+manifest = Manifest(MANIFEST_PATH, PIPELINE_VERSION)
+tasks = []
 for f in dbutils.fs.ls(''):
     filepath = "/" + f.path.replace(':','')
-    transformed_irr(filepath)
+    if not manifest.is_current(filepath):
+        tasks.append((transformed_irr, (filepath,)))
+
+results = run_tasks(tasks, max_workers=N_WORKERS)
+manifest.record_results(results)
+SessionIndex().record_results(results)
 
 # COMMAND ----------
 
@@ -9,17 +9,37 @@ import io
 
 # COMMAND ----------
 
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Runner
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Configs
+
+# COMMAND ----------
+
+TABLE_NAME = 'note'
+PIPELINE_VERSION = '1'
+MANIFEST_PATH = '/dbfs/mnt/testmount/output/manifest/Note.parquet'
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ## Main Code
 
 # COMMAND ----------
 
-def transform_note(filepath):
+def transform_note(filepath, content=None):
     # import data and transpose
-    with open(filepath, "rb") as f:
-        file_content = f.read()
     # Load the binary data into a pandas DataFrame
-    df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
+    with span('read'), open_input(filepath, content) as source:
+        df = pd.read_excel(source, engine='openpyxl')
+    count('sheets_parsed')
+    count('rows_in', len(df))
 
     # drop extra column
     initial_cols = list(map(str.lower, df.columns))
@@ -28,7 +48,10 @@ def transform_note(filepath):
         df.drop(df.columns[idx], axis=1, inplace=True)
 
     # drop duplicate data
-    df.drop_duplicates(inplace=True)
+    with span('dedupe'):
+        rows = len(df)
+        df.drop_duplicates(inplace=True)
+    count('rows_dropped_duplicates', rows - len(df))
     # rearrange column format
     df.rename(columns=str.lower,inplace=True)
     df.columns = df.columns.str.replace(' ','_')
@@ -39,7 +62,7 @@ def transform_note(filepath):
         print(filepath)
 
     output_path = '/dbfs/mnt/testmount/output/Note/'
-    df.to_csv(os.path.join(output_path, f.name.split('/')[-1].split('.')[0] + '.csv'), index=False)
+    write_output(df, output_path, filepath.split('/')[-1].split('.')[0], TABLE_NAME)
 
 # COMMAND ----------
 
@@ -48,9 +71,16 @@ def transform_note(filepath):
 
 # COMMAND ----------
 
+manifest = Manifest(MANIFEST_PATH, PIPELINE_VERSION)
+tasks = []
 for f in sorted(dbutils.fs.ls('')):
     filepath = "/" + f.path.replace(':','')
-    transform_note(filepath)
+    if not manifest.is_current(filepath):
+        tasks.append((transform_note, (filepath,)))
+
+results = run_tasks(tasks, max_workers=N_WORKERS)
+manifest.record_results(results)
+SessionIndex().record_results(results)
 
 # COMMAND ----------
 
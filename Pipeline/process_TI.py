@@ -9,13 +9,28 @@ import io
 
 # COMMAND ----------
 
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_RFID
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Runner
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC ## Configs
 
 # COMMAND ----------
 
-RFID_OXY = pd.read_csv('', index_col=0)
-RFID_OXY.head()
+TABLE_NAME = 'tail_immersion'
+PIPELINE_VERSION = '1'
+MANIFEST_PATH = '/dbfs/mnt/testmount/output/manifest/TI.parquet'
+
+RFID_OXY = load_rfid_index('')
 
 # COMMAND ----------
 
@@ -24,21 +39,19 @@ RFID_OXY.head()
 
 # COMMAND ----------
 
-def transform_ti(filepath):
-    with open(filepath, "rb") as f:
-        file_content = f.read()
+def transform_ti(filepath, content=None):
     # Load the binary data into a pandas DataFrame
-    df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
+    with span('read'), open_input(filepath, content) as source:
+        df = pd.read_excel(source, engine='openpyxl')
+    count('sheets_parsed')
+    count('rows_in', len(df))
     df['Drug'] = df['Drug'].str.lower()
     df.rename(columns=str.lower,inplace=True)
     df.columns = df.columns.str.replace(' ','_')
-    dff = pd.merge(df, RFID_OXY,  how='left', on = ['subject'])
-    old_columns = dff.columns.tolist()
-    new_columns = [old_columns[-1]] + old_columns[:-1]
-    dff = dff[new_columns]
+    dff = insert_rfid(df, RFID_OXY)
 
     output_path = ''
-    dff.to_csv(os.path.join(output_path, f.name.split('/')[-1].split('.')[0] + '.csv'), index=False)
+    write_output(dff, output_path, filepath.split('/')[-1].split('.')[0], TABLE_NAME)
 
 # COMMAND ----------
 
@@ -47,9 +60,16 @@ def transform_ti(filepath):
 
 # COMMAND ----------
 
+manifest = Manifest(MANIFEST_PATH, PIPELINE_VERSION)
+tasks = []
 for f in dbutils.fs.ls(''):
     filepath = "/" + f.path.replace(':','')
-    transform_ti(filepath)
+    if not manifest.is_current(filepath):
+        tasks.append((transform_ti, (filepath,)))
+
+results = run_tasks(tasks, max_workers=N_WORKERS, shared={'RFID_OXY': RFID_OXY})
+manifest.record_results(results)
+SessionIndex().record_results(results)
 
 # COMMAND ----------
 
@@ -6,7 +6,22 @@
 import pandas as pd
 import os
 import io
-from datetime import datetime
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Output
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_RFID
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Coerce
+
+# COMMAND ----------
+
+# MAGIC %run ./helper_Runner
 
 # COMMAND ----------
 
@@ -15,8 +30,11 @@ from datetime import datetime
 
 # COMMAND ----------
 
-RFID_OXY = pd.read_csv('', index_col=0)
-RFID_OXY['rfid'].isna().sum()
+TABLE_NAME = 'von_frey'
+PIPELINE_VERSION = '1'
+MANIFEST_PATH = '/dbfs/mnt/testmount/output/manifest/VF.parquet'
+
+RFID_OXY = load_rfid_index('')
 
 # COMMAND ----------
 
@@ -25,10 +43,13 @@ RFID_OXY['rfid'].isna().sum()
 
 # COMMAND ----------
 
-def parse_date(date_string):
-    first_date = date_string.split('-')[0]
-    date = datetime.strptime(first_date, "%m/%d/%y").date()
-    return date
+# date of the first day of every 'mm/dd/yy-mm/dd/yy' range, parsed once per distinct value. The dates the sheet
+# already typed are kept
+def parse_date(values):
+    first_dates = values.astype(object)
+    is_str = string_mask(first_dates)
+    first_dates[is_str] = first_dates[is_str].str.split('-').str[0]
+    return parse_dates(first_dates, "%m/%d/%y")
 
 # COMMAND ----------
 
@@ -37,26 +58,24 @@ def parse_date(date_string):
 
 # COMMAND ----------
 
-def transform_vf(filepath):
-    with open(filepath, "rb") as f:
-        file_content = f.read()
+def transform_vf(filepath, content=None):
     # Load the binary data into a pandas DataFrame
-    df = pd.read_excel(io.BytesIO(file_content), engine='openpyxl')
+    with span('read'), open_input(filepath, content) as source:
+        df = pd.read_excel(source, engine='openpyxl')
+    count('sheets_parsed')
+    count('rows_in', len(df))
     df['Drug'] = df['Drug'].str.lower()
     df.rename(columns=str.lower,inplace=True)
     df.columns = df.columns.str.strip()
     df.columns = df.columns.str.replace(' ','_')
-    dff = pd.merge(df, RFID_OXY,  how='left', on = ['subject'])
-    old_columns = dff.columns.tolist()
-    new_columns = [old_columns[-1]] + old_columns[:-1]
-    dff = dff[new_columns]
+    dff = insert_rfid(df, RFID_OXY)
 
     for col in dff.columns:
         if ('date' in col) and dff[col].dtype != '<M8[ns]':
-            dff[col] = dff[col].apply(lambda x: parse_date(x))
+            dff[col] = parse_date(dff[col])
 
     output_path = ''
-    dff.to_csv(os.path.join(output_path, f.name.split('/')[-1].split('.')[0] + '.csv'), index=False)
+    write_output(dff, output_path, filepath.split('/')[-1].split('.')[0], TABLE_NAME)
 
 # COMMAND ----------
 
@@ -65,10 +84,16 @@ def transform_vf(filepath):
 
 # COMMAND ----------
 
+manifest = Manifest(MANIFEST_PATH, PIPELINE_VERSION)
+tasks = []
 for f in dbutils.fs.ls(''):
     filepath = "/" + f.path.replace(':','')
-    print(filepath)
-    transform_vf(filepath)
+    if not manifest.is_current(filepath):
+        tasks.append((transform_vf, (filepath,)))
+
+results = run_tasks(tasks, max_workers=N_WORKERS, shared={'RFID_OXY': RFID_OXY})
+manifest.record_results(results)
+SessionIndex().record_results(results)
 
 # COMMAND ----------
 
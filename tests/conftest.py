@@ -0,0 +1,63 @@
+import os
+import re
+import sys
+import types
+import pytest
+
+PIPELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Pipeline')
+
+# run the cells of one notebook and of the notebooks it includes with %run into namespace. The cells holding one of
+# skip (the driver code of a process notebook) are left out
+def run_notebook(name, namespace, skip=()):
+    path = os.path.join(PIPELINE, name + '.py')
+    with open(path) as f:
+        cells = f.read().split('# COMMAND ----------')
+    for cell in cells:
+        included = re.search(r'# MAGIC %run \./(\S+)', cell)
+        if included:
+            run_notebook(included.group(1), namespace)
+        elif not any([marker in cell for marker in skip]):
+            exec(compile(cell, path, 'exec'), namespace)
+    return namespace
+
+@pytest.fixture(scope='session')
+def excel():
+    return run_notebook('helper_Excel', {'__name__': 'helper_Excel'})
+
+@pytest.fixture(scope='session')
+def output():
+    return run_notebook('helper_Output', {'__name__': 'helper_Output'})
+
+@pytest.fixture(scope='session')
+def timestamps():
+    return run_notebook('helper_Timestamps', {'__name__': 'helper_Timestamps'})
+
+@pytest.fixture(scope='session')
+def sniff():
+    return run_notebook('helper_Sniff', {'__name__': 'helper_Sniff'})
+
+@pytest.fixture(scope='session')
+def coerce():
+    return run_notebook('helper_Coerce', {'__name__': 'helper_Coerce'})
+
+@pytest.fixture(scope='session')
+def medpc():
+    return run_notebook('helper_MedPC', {'__name__': 'helper_MedPC'})
+
+@pytest.fixture(scope='session')
+def rfid():
+    return run_notebook('helper_RFID', {'__name__': 'helper_RFID'})
+
+# the process pool pickles the notebook functions by module name, the forked workers find the module in sys.modules
+@pytest.fixture(scope='session')
+def runner():
+    module = types.ModuleType('helper_Runner')
+    sys.modules['helper_Runner'] = module
+    return run_notebook('helper_Runner', module.__dict__)
+
+# the cohort notebook without its driver cells (header files written at start up, main())
+@pytest.fixture(scope='session')
+def cohort():
+    return run_notebook('process_Cohort_Information', {'__name__': 'process_Cohort_Information'},
+                        skip=('\nmain()', 'to_csv(SUBJECT_OUTPUT_FILEPATH, index=False)',
+                              'to_csv(MEASUREMENT_OUTPUT_FILEPATH, index=False)'))
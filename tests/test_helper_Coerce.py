@@ -0,0 +1,32 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+
+def test_parse_times_raises_on_malformed_strings(coerce):
+    with pytest.raises(ValueError):
+        coerce['parse_times'](pd.Series(['10:00:00', 'ten o clock']), "%H:%M:%S")
+
+def test_parse_times_converts_typed_cells(coerce):
+    values = pd.Series(['10:00:00', datetime.time(11, 0, 0, 999999), pd.Timestamp('2023-01-02 12:30:00'),
+                        datetime.datetime(2023, 1, 2, 13, 0), np.nan], name='start_time')
+    with coerce['task_metrics']('test', 'source') as metrics:
+        parsed = coerce['parse_times'](values, "%H:%M:%S", default=datetime.time(0))
+    assert list(parsed) == [datetime.time(10), datetime.time(11, 0, 1), datetime.time(12, 30), datetime.time(13),
+                            datetime.time(0)]
+    assert 'values_coerced' not in metrics.counters
+
+def test_parse_dates_converts_typed_cells(coerce):
+    values = pd.Series(['01/02/2023', pd.Timestamp('2023-01-03'), datetime.date(2023, 1, 4), None], name='start_date')
+    parsed = coerce['parse_dates'](values, "%m/%d/%Y")
+    assert list(parsed[:3]) == [datetime.date(2023, 1, 2), datetime.date(2023, 1, 3), datetime.date(2023, 1, 4)]
+    assert parsed[3] is None
+
+def test_parse_dates_reports_the_cells_it_can_not_read(coerce, capsys):
+    values = pd.Series(['01/02/2023', 44927, 44927, datetime.time(10)], name='start_date')
+    with coerce['task_metrics']('test', 'source') as metrics:
+        parsed = coerce['parse_dates'](values, "%m/%d/%Y")
+    assert parsed[0] == datetime.date(2023, 1, 2)
+    assert list(pd.isnull(parsed)) == [False, True, True, True]
+    assert metrics.counters['values_coerced'] == 3
+    assert '3 start_date values' in capsys.readouterr().out
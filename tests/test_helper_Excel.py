@@ -0,0 +1,98 @@
+import io
+import datetime
+import re
+import zipfile
+import pandas as pd
+from openpyxl import Workbook
+
+# a small MED-PC wide export: one label per row, one subject per column, array slots padded with zeros
+def medpc_workbook(num_subjects=3, num_slots=6):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Filename'] + [f'file{i}' for i in range(num_subjects)])
+    ws.append(['Subject'] + [f'M{100 + i}' for i in range(num_subjects)])
+    ws.append(['Box'] + list(range(1, num_subjects + 1)))
+    for slot in range(1, num_slots + 1):
+        ws.append([f'Active {slot}'] + [float(slot) if slot <= 3 else 0 for _ in range(num_subjects)])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+# the same workbook with the <dimension> tag of its sheet rewritten to ref
+def with_dimension(content, ref):
+    source, target = io.BytesIO(content), io.BytesIO()
+    with zipfile.ZipFile(source) as zin, zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            if item.filename.startswith('xl/worksheets/'):
+                data = re.sub(rb'<dimension ref="[^"]*"', b'<dimension ref="' + ref.encode() + b'"', data)
+            zout.writestr(item, data)
+    return target.getvalue()
+
+def pandas_wide(content):
+    df = pd.read_excel(io.BytesIO(content), header=None).T
+    df.columns = df.iloc[0]
+    return df.iloc[1:].reset_index(drop=True)
+
+def test_parse_medpc_wide_matches_pandas(excel):
+    content = medpc_workbook()
+    df = excel['parse_medpc_wide'](io.BytesIO(content))
+    expected = pandas_wide(content)
+    assert list(df.columns) == list(expected.columns)
+    assert df.shape == expected.shape == (3, 9)
+
+def test_parse_medpc_wide_ignores_stale_dimension(excel):
+    content = medpc_workbook()
+    stale = with_dimension(content, 'A1')
+    # pandas resets the dimensions of a stale sheet, the wide reader has to read every row too
+    assert pandas_wide(stale).shape == (3, 9)
+    pd.testing.assert_frame_equal(excel['parse_medpc_wide'](io.BytesIO(stale)),
+                                  excel['parse_medpc_wide'](io.BytesIO(content)))
+
+def test_parse_medpc_wide_skips_padding_with_stale_dimension(excel):
+    stale = with_dimension(medpc_workbook(), 'A1')
+    df = excel['parse_medpc_wide'](io.BytesIO(stale), array_patterns=[r'Active \d+'])
+    assert list(df.columns) == ['Filename', 'Subject', 'Box', 'Active 1', 'Active 2', 'Active 3']
+    assert list(df['Active 3']) == [3.0, 3.0, 3.0]
+
+# read_excel + transpose + header promotion, as the transforms read the wide exports before the wide reader
+def baseline_wide(content):
+    df_raw = pd.read_excel(io.BytesIO(content), engine='openpyxl').T
+    df_raw.reset_index(inplace=True)
+    df = df_raw[1:]
+    df.columns = df_raw.iloc[0]
+    return df.reset_index(drop=True)
+
+def test_parse_medpc_wide_keeps_duplicate_labels(excel):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Filename', 'file0', 'file1'])
+    ws.append(['Subject', 'M100', 'M101'])
+    ws.append(['Active 1', 1, 2])
+    ws.append(['Active 1', 3, 4])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    df = excel['parse_medpc_wide'](io.BytesIO(buffer.getvalue()))
+    expected = baseline_wide(buffer.getvalue())
+    assert list(df.columns) == list(expected.columns) == ['Filename', 'Subject', 'Active 1', 'Active 1']
+    assert df.iloc[:, 2].tolist() == [1, 2]
+    assert df.iloc[:, 3].tolist() == [3, 4]
+
+def test_parse_medpc_wide_mixed_rows_match_baseline(excel):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Filename', 'file0', 'file1', 'file2'])
+    ws.append(['Start Date', datetime.datetime(2023, 1, 2), '01/03/23', '2023-01-04'])
+    ws.append(['Start Time', datetime.time(10, 1, 2), '10:01:02', None])
+    ws.append(['Subject', 'M100', 'NA', 5])
+    ws.append(['Box', 1, 2.0, 3.5])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    df = excel['parse_medpc_wide'](io.BytesIO(buffer.getvalue()))
+    expected = baseline_wide(buffer.getvalue())
+    assert list(df.columns) == list(expected.columns)
+    for label in ['Start Date', 'Start Time', 'Subject']:
+        for value, baseline in zip(df[label], expected[label]):
+            assert type(value) == type(baseline)
+            assert (pd.isnull(value) and pd.isnull(baseline)) or value == baseline
+    assert df['Box'].tolist() == expected['Box'].tolist()
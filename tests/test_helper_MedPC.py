@@ -0,0 +1,104 @@
+import zipfile
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+# an OLD_SA workbook with one small sheet per name
+def old_sa_workbook(path, names):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name in names:
+        ws = wb.create_sheet(name)
+        ws.append(['Subject', 'M100', 'M101'])
+        ws.append(['Active Lever Presses', 1, 2])
+    wb.save(path)
+    return str(path)
+
+@pytest.fixture
+def sheet_limit(medpc):
+    limit = medpc['OLD_SA_SHEET_MAX_BYTES']
+    yield
+    medpc['OLD_SA_SHEET_MAX_BYTES'] = limit
+
+def test_old_sa_workbook_goes_on_past_a_failed_sheet(medpc, tmp_path, sheet_limit):
+    wb = old_sa_workbook(tmp_path / 'old.xlsx', ['A', 'B', 'C'])
+    done = []
+    def transform(wb, ws, df_sheet):
+        if ws == 'B':
+            raise ValueError('bad sheet')
+        done.append(ws)
+    def task(wb, worksheets):
+        medpc['transform_old_sa_workbook'](wb, worksheets, transform)
+
+    medpc['OLD_SA_SHEET_MAX_BYTES'] = None
+    result = medpc['run_task']((task, (wb, ['A', 'B', 'C'])))
+    assert done == ['A', 'C']
+    assert result['status'] == 'partial'
+    assert list(result['failed']) == ['B'] and 'bad sheet' in result['error']
+
+    manifest = medpc['Manifest'](str(tmp_path / 'manifest.parquet'), 'v1')
+    manifest.record_results(pd.DataFrame([result]))
+    assert manifest.pending(wb, ['A', 'B', 'C']) == ['B']
+
+def test_old_sa_workbook_leaves_oversized_sheets_pending(medpc, tmp_path, sheet_limit):
+    wb = old_sa_workbook(tmp_path / 'old.xlsx', ['A', 'B'])
+    def task(wb, worksheets):
+        medpc['transform_old_sa_workbook'](wb, worksheets, lambda wb, ws, df_sheet: None)
+
+    medpc['OLD_SA_SHEET_MAX_BYTES'] = 1
+    result = medpc['run_task']((task, (wb, ['A', 'B'])))
+    assert result['status'] == 'ok'
+    assert sorted(result['skipped']) == ['A', 'B']
+
+    manifest = medpc['Manifest'](str(tmp_path / 'manifest.parquet'), 'v1')
+    manifest.record_results(pd.DataFrame([result]))
+    manifest = medpc['Manifest'](str(tmp_path / 'manifest.parquet'), 'v1')
+    # once the limit is raised the sheets are parsed on the next run
+    assert manifest.pending(wb, ['A', 'B']) == ['A', 'B']
+
+def test_old_sa_workbook_goes_on_past_an_unreadable_sheet(medpc, tmp_path, sheet_limit):
+    wb = old_sa_workbook(tmp_path / 'old.xlsx', ['A', 'B', 'C'])
+    broken = str(tmp_path / 'broken.xlsx')
+    with zipfile.ZipFile(wb) as zin, zipfile.ZipFile(broken, 'w') as zout:
+        for item in zin.infolist():
+            data = zin.read(item.filename)
+            if item.filename == 'xl/worksheets/sheet2.xml':
+                data = data.replace(b'<v>1</v>', b'<v>one</v>')
+            zout.writestr(item, data)
+    done = []
+    def task(wb, worksheets):
+        medpc['transform_old_sa_workbook'](wb, worksheets, lambda wb, ws, df_sheet: done.append(ws))
+
+    medpc['OLD_SA_SHEET_MAX_BYTES'] = None
+    result = medpc['run_task']((task, (broken, ['A', 'B', 'C'])))
+    assert done == ['A', 'C']
+    assert result['status'] == 'partial' and list(result['failed']) == ['B']
+
+def test_ratio_schedule_looks_up_the_breakpoint_and_last_ratio_by_position(medpc):
+    cocaine = medpc['get_schedule']('cocaine')
+    breakpoints, last_ratios = cocaine.lookup([0, 3, 10, 18])
+    assert list(breakpoints) == [0, 4, 32, 178]
+    # 32 is between the 25 and 40 steps of the reward counts, its last ratio is the step after it, 40
+    assert list(last_ratios[:3]) == [1, 6, 40] and np.isnan(last_ratios[3])
+
+def test_ratio_schedule_with_repeated_ratios(medpc):
+    oxycodone = medpc['get_schedule']('oxycodone')
+    breakpoints, last_ratios = oxycodone.lookup([1, 2, 3, 64])
+    assert list(breakpoints) == [1, 1, 2, 100]
+    # the second 1 of the schedule is followed by a 2, the first one by the second 1
+    assert list(last_ratios) == [1, 2, 2, 100]
+
+def test_ratio_schedule_leaves_counts_between_steps_empty(medpc):
+    schedule = medpc['RatioSchedule']([0, 1, 2, 4, 6])
+    breakpoints, last_ratios = schedule.lookup([2.5, -1, 5, np.nan, 'x', '3'])
+    assert np.isnan(breakpoints[:5]).all() and np.isnan(last_ratios[:5]).all()
+    assert breakpoints[5] == 4 and last_ratios[5] == 6
+
+def test_add_ratio_columns_keeps_integers_unless_a_value_is_missing(medpc):
+    medpc['register_schedule']('test', [0, 1, 2, 4, 6])
+    df = medpc['add_ratio_columns'](pd.DataFrame({'reward_presses': [0, 3]}), 'test')
+    assert df['breakpoint'].dtype == 'int64' and list(df['breakpoint']) == [0, 4]
+    assert list(df['last_ratio']) == [1, 6]
+    df = medpc['add_ratio_columns'](pd.DataFrame({'reward_presses': [3, 4.5]}), 'test')
+    assert df['breakpoint'].dtype == 'float64' and df['breakpoint'][0] == 4 and np.isnan(df['last_ratio'][1])
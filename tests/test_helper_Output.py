@@ -0,0 +1,94 @@
+import os
+import datetime
+import numpy as np
+import pandas as pd
+
+def trial_frame(subjects, **columns):
+    df = pd.DataFrame({'rfid': [1000 + i for i in range(len(subjects))], 'subject': subjects, 'cohort': '01',
+                       'trial_id': 'LGA01', 'drug': 'cocaine', 'active_lever_presses': 3})
+    df['active_timestamps'] = [np.array([1.0, 2.0, 3.0])] * len(df)
+    for col, value in columns.items():
+        df[col] = [value] * len(df)
+    return df
+
+def test_parquet_dataset_mixes_general_and_old_sa_parts(output, tmp_path):
+    # an OLD_SA sheet leaves the box empty and gives the end date as a date, a general export gives numbers and timestamps
+    old = trial_frame(['M100', 'M101'], box=None, end_date=datetime.date(2020, 1, 1))
+    general = trial_frame(['M102'], box=3, end_date=pd.Timestamp('2020-01-02'))
+    output['write_parquet_dataset'](old, 'trial_lga', 'old', root=str(tmp_path))
+    output['write_parquet_dataset'](general, 'trial_lga', 'general', root=str(tmp_path))
+
+    df = pd.read_parquet(os.path.join(tmp_path, 'trial_lga')).sort_values('subject', ignore_index=True)
+    assert list(df['box'].isnull()) == [True, True, False]
+    assert list(df['end_date']) == [datetime.date(2020, 1, 1)] * 2 + [datetime.date(2020, 1, 2)]
+    assert list(df['active_timestamps'][2]) == [1.0, 2.0, 3.0]
+
+def index_results(output, writes):
+    '''run_tasks-like results of tasks writing (status, frame, path) through write_output'''
+    statuses, outputs = [], []
+    for status, df, path in writes:
+        offsets = output['write_csv'](df, path)
+        statuses.append(status)
+        outputs.append(output['output_index_entries'](df, 'trial_lga', path, offsets))
+    return pd.DataFrame({'status': statuses, 'outputs': outputs})
+
+def test_session_index_drops_rewritten_and_failed_outputs(output, tmp_path):
+    index = output['SessionIndex'](str(tmp_path / 'index'))
+    first, second = str(tmp_path / 'first.csv'), str(tmp_path / 'second.csv')
+    index.record_results(index_results(output, [('ok', trial_frame(['M100', 'M101']), first),
+                                                ('ok', trial_frame(['M100']), second)]))
+    assert len(index.lookup(subject='M100')['trial_lga']) == 2
+
+    # first is written again with no rows, second by a task that failed afterwards
+    index.record_results(index_results(output, [('ok', trial_frame([]), first),
+                                                ('error', trial_frame(['M100']), second)]))
+    assert len(index.sessions(subject='M100')) == 0
+    assert len(index.sessions(subject='M101')) == 0
+
+def test_session_index_lookup_checks_stale_rows(output, tmp_path):
+    index = output['SessionIndex'](str(tmp_path / 'index'))
+    path = str(tmp_path / 'trial.csv')
+    index.record_results(index_results(output, [('ok', trial_frame(['M100', 'M101', 'M102']), path)]))
+    # the output shrank after the index was written
+    trial_frame(['M100']).to_csv(path, index=False)
+    assert list(index.lookup(subject='M102')['trial_lga']['subject']) == []
+    assert list(index.lookup(subject='M100')['trial_lga']['subject']) == ['M100']
+
+def test_session_index_reads_only_the_indexed_bytes(output, tmp_path):
+    index = output['SessionIndex'](str(tmp_path / 'index'))
+    path = str(tmp_path / 'trial.csv')
+    df = trial_frame(['M100', 'M101', 'M100', 'M102'])
+    # quoted fields holding newlines and quotes do not end a row
+    df['note'] = ['one', 'two\nlines', 'say "three"', 'four,\n"five"']
+    index.record_results(index_results(output, [('ok', df, path)]))
+
+    # garble the rows of the other rats in place: a targeted read never parses them
+    with open(path, 'r+b') as f:
+        for entry in index.sessions(subject='M101').to_dict('records') + index.sessions(subject='M102').to_dict('records'):
+            f.seek(entry['byte_start'])
+            f.write(b'"' * (entry['byte_stop'] - entry['byte_start']))
+    found = index.lookup(subject='M100')['trial_lga']
+    assert list(found['rfid']) == [1000, 1002]
+    assert list(found['note']) == ['one', 'say "three"']
+    assert list(found['output']) == [path, path]
+
+def test_session_index_looks_up_the_parquet_dataset(output, tmp_path, monkeypatch):
+    monkeypatch.setitem(output, 'SESSION_INDEX_ROOT', str(tmp_path / 'index'))
+    monkeypatch.setitem(output, 'PARQUET_OUTPUT_ROOT', str(tmp_path / 'parquet'))
+    statuses, outputs = [], []
+    for fname, subjects in [('C01LGA01', ['M100', 'M101']), ('C01LGA02', ['M101', 'M100', 'M102']),
+                            ('C01LGA1', ['M101'])]:
+        with output['task_metrics']('test', fname) as metrics:
+            output['write_output'](trial_frame(subjects, trial_id=fname[3:]), str(tmp_path), fname, 'trial_lga')
+        statuses.append('ok')
+        outputs.append(metrics.outputs)
+    index = output['SessionIndex']()
+    index.record_results(pd.DataFrame({'status': statuses, 'outputs': outputs}))
+
+    csv = index.lookup(subject='M101')['trial_lga']
+    parquet = index.lookup(subject='M101', sink='parquet')['trial_lga']
+    assert list(csv['output']) == list(parquet['output'])
+    assert list(csv['rfid']) == list(parquet['rfid']) == [1001, 1000, 1000]
+    assert list(parquet['trial_id']) == ['LGA01', 'LGA02', 'LGA1']
+    # by rfid, the key is cast to the type of the column
+    assert list(index.lookup(rfid=1002, sink='parquet')['trial_lga']['subject']) == ['M102']
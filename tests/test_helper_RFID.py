@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.fixture
+def index(rfid):
+    # M102 is listed twice, M103 has no rfid
+    table = pd.DataFrame({'subject': ['M100', 'M101', 'M102', 'M102', 'M103'],
+                          'rfid': [933000100.0, 933000101.0, 933000102.0, 933000999.0, np.nan]})
+    return rfid['RFIDIndex'](table)
+
+def test_lookup_marks_the_missing_subjects(rfid, index):
+    rfids, found = index.lookup(['M101', 'M999', 'M103', 'M100'])
+    assert list(found) == [True, False, False, True]
+    assert list(rfids) == [933000101, rfid['MISSING_RFID'], rfid['MISSING_RFID'], 933000100]
+
+def test_lookup_keeps_the_first_rfid_of_a_subject_listed_twice(index):
+    rfids, found = index.lookup(['M102'])
+    assert found.all() and list(rfids) == [933000102]
+
+def test_merge_rfid_drops_the_missing_subjects(rfid, index, capsys):
+    df = pd.DataFrame({'subject': ['M100', 'M999', 'M102', 'M102'], 'box': [1, 2, 3, 4]})
+    with rfid['task_metrics']('test', 'source') as metrics:
+        merged = rfid['merge_rfid'](df, index, ['rfid', 'subject', 'box'])
+    # a subject in two sessions keeps both, the subject listed twice in the table is not doubled
+    assert merged.to_dict('list') == {'rfid': [933000100, 933000102, 933000102], 'subject': ['M100', 'M102', 'M102'],
+                                      'box': [1, 3, 4]}
+    assert metrics.counters['rows_dropped_rfid'] == 1
+    assert "1 subjects without an rfid: ['M999']" in capsys.readouterr().out
+
+def test_insert_rfid_leaves_the_missing_subjects_empty(rfid, index):
+    df = pd.DataFrame({'subject': ['M999', 'M102'], 'box': [1, 2]})
+    with rfid['task_metrics']('test', 'source') as metrics:
+        inserted = rfid['insert_rfid'](df, index)
+    assert list(inserted.columns) == ['rfid', 'subject', 'box']
+    assert inserted['rfid'].dtype == 'Int64'
+    assert pd.isna(inserted['rfid'][0]) and inserted['rfid'][1] == 933000102
+    assert metrics.counters['rows_missing_rfid'] == 1
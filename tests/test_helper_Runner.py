@@ -0,0 +1,61 @@
+import os
+import hashlib
+import sys
+import threading
+import pytest
+
+@pytest.fixture
+def inputs(tmp_path):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f'input{i}.bin'
+        path.write_bytes(bytes([i]) * 1000)
+        paths.append(str(path))
+    return paths
+
+# a task counting how its input came in: prefetched bytes or a memory map of the file
+def read_input(filepath, content=None):
+    runner = sys.modules['helper_Runner']
+    with runner.open_input(filepath, content) as source:
+        runner.count('mapped' if isinstance(source, runner.MappedInput) else 'prefetched')
+        assert len(source.read()) == 1000
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_tasks_map_the_prefetched_files(runner, inputs, max_workers):
+    results = runner['run_tasks']([(read_input, (path,)) for path in inputs], max_workers=max_workers, prefetch=True)
+    assert list(results['status']) == ['ok'] * len(inputs)
+    assert [m['counters'] for m in results['metrics']] == [{'mapped': 1, 'bytes_read': 1000}] * len(inputs)
+
+def test_prefetch_reports_unreadable_inputs(runner, inputs, tmp_path):
+    tasks = [(read_input, (path,)) for path in inputs + [str(tmp_path / 'missing.bin')]]
+    results = runner['run_tasks'](tasks, max_workers=2, prefetch=True)
+    assert list(results['status']) == ['ok'] * len(inputs) + ['error']
+    assert 'missing.bin' in results['error'].iloc[-1]
+
+# names of the threads alive at every fork of this process
+FORKS = []
+os.register_at_fork(before=lambda: FORKS.append([thread.name for thread in threading.enumerate()]))
+
+def test_pool_forks_before_the_prefetch_thread(runner, inputs):
+    FORKS.clear()
+    runner['run_tasks']([(read_input, (path,)) for path in inputs], max_workers=2, prefetch=True)
+    assert len(FORKS) == 2
+    assert not any(['prefetch' in names for names in FORKS])
+
+# a task whose input is rewritten on disk once it read it
+def read_then_rewrite(filepath, content=None):
+    read_input(filepath, content)
+    with open(filepath, 'wb') as f:
+        f.write(b'changed during the run')
+
+def test_manifest_records_the_content_the_task_read(runner, inputs, tmp_path):
+    original = hashlib.sha256(open(inputs[0], 'rb').read()).hexdigest()
+    results = runner['run_tasks']([(read_then_rewrite, (inputs[0],)), (read_input, (inputs[1],))], max_workers=1)
+    assert results['input'].iloc[0]['sha256'] == original
+
+    manifest = runner['Manifest'](str(tmp_path / 'manifest.parquet'), 'v1')
+    manifest.file_hash = None
+    manifest.record_results(results)
+    manifest = runner['Manifest'](str(tmp_path / 'manifest.parquet'), 'v1')
+    assert not manifest.is_current(inputs[0])
+    assert manifest.is_current(inputs[1])
@@ -0,0 +1,26 @@
+import io
+from openpyxl import Workbook
+
+def workbook(num_slots):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Filename', 'file0', 'file1'])
+    ws.append(['Subject', 'M100', 'M101'])
+    for slot in range(1, num_slots + 1):
+        ws.append([f'Active {slot}', float(slot), float(slot)])
+    ws.append(['Reward', 2, 3])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def test_sniff_workbook_stops_after_first_rows(sniff):
+    header = sniff['sniff_workbook'](workbook(100))
+    assert header.format == 'general'
+    assert len(header.rows) == sniff['SNIFF_ROWS']
+    assert 'Active 50' not in header.labels
+    assert header.subject_columns == 2
+
+def test_sniff_workbook_reads_up_to_the_labels_asked_for(sniff):
+    header = sniff['sniff_workbook'](workbook(100), ['Subject', 'Reward'])
+    assert header.labels['Reward'] == 103
+    assert 'Missing' not in sniff['sniff_workbook'](workbook(100), ['Missing']).labels
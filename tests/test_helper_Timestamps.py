@@ -0,0 +1,16 @@
+import numpy as np
+
+def test_event_metrics_rate_curve(timestamps):
+    offsets = np.array([0, 3, 3, 5])
+    values = np.array([10.0, 20.0, 700.0, 1300.0, 1310.0])
+    metrics = timestamps['event_metrics'](offsets, values)
+    assert list(metrics['rate_curve'][0]) == [2, 1]
+    assert metrics['rate_curve'][1] is None
+    assert list(metrics['rate_curve'][2]) == [0, 0, 2]
+
+def test_event_metrics_skips_non_finite_times_in_rate_curve(timestamps):
+    offsets = np.array([0, 3, 5])
+    values = np.array([10.0, np.nan, 700.0, np.inf, 20.0])
+    metrics = timestamps['event_metrics'](offsets, values)
+    assert list(metrics['rate_curve'][0]) == [1, 1]
+    assert list(metrics['rate_curve'][1]) == [1]
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import psycopg2.extensions
+import pytest
+from unittest.mock import MagicMock
+
+def test_coerce_dates_reports_the_cells_that_are_not_dates(cohort, capsys):
+    values = pd.Series(['2023-01-02', 'pending', None, 'n/a'], name='date_of_birth')
+    with cohort['task_metrics']('test', 'source') as metrics:
+        parsed = cohort['CohortProcess'].coerce_dates(values)
+    assert parsed[0] == pd.Timestamp('2023-01-02')
+    assert list(parsed.isna()) == [False, True, True, True]
+    assert metrics.counters['values_coerced'] == 2
+    assert '2 date_of_birth values' in capsys.readouterr().out
+
+# a Pipeline on a mocked pool: the statements the cursor ran rendered as text and the payloads it copied
+@pytest.fixture
+def pipeline(cohort, monkeypatch):
+    monkeypatch.setattr(psycopg2.extensions, 'quote_ident', lambda name, context: '"' + name.replace('"', '""') + '"')
+    cursor = MagicMock()
+    cursor.rowcount = 2
+    cursor.__enter__.return_value = cursor
+    cursor.copy_expert.side_effect = lambda statement, buffer: cursor.copied.append((statement, buffer.read()))
+    cursor.copied = []
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    loader = cohort['Pipeline'].__new__(cohort['Pipeline'])
+    loader.pool = MagicMock()
+    loader.pool.getconn.return_value = conn
+    return loader, conn, cursor
+
+def executed(cursor):
+    return [call.args[0].as_string(None) for call in cursor.execute.call_args_list]
+
+def test_load_table_updates_the_rows_already_loaded(pipeline):
+    loader, conn, cursor = pipeline
+    df = pd.DataFrame({'rfid': ['1', '2', '1'], 'measurement_name': ['weight'] * 3,
+                       'measure_number': [1.0, 1.0, 1.0], 'measurement_value': [300.5, np.nan, 310.0]})
+    loaded = loader.load_table(df, 'measurement', ['rfid', 'measurement_name', 'measurement_value', 'measure_number'],
+                               ['rfid', 'measurement_name', 'measure_number'], batch_rows=1)
+    assert loaded == 2
+    create, insert = executed(cursor)
+    assert create == 'CREATE TEMP TABLE "staging_measurement" (LIKE "measurement" INCLUDING DEFAULTS) ON COMMIT DROP'
+    assert insert == ('INSERT INTO "measurement" ("rfid","measurement_name","measurement_value","measure_number") '
+                      'SELECT "rfid","measurement_name","measurement_value","measure_number" FROM "staging_measurement" '
+                      'ON CONFLICT ("rfid","measurement_name","measure_number") '
+                      'DO UPDATE SET "measurement_value" = EXCLUDED."measurement_value"')
+    # one batch per row, the repeated key keeps its last row, nulls are empty fields and whole floats integers
+    assert cursor.copied == [
+        ("""COPY "staging_measurement" ("rfid","measurement_name","measurement_value","measure_number") FROM STDIN WITH (FORMAT csv, NULL '')""",
+         '2,weight,,1\n'),
+        ("""COPY "staging_measurement" ("rfid","measurement_name","measurement_value","measure_number") FROM STDIN WITH (FORMAT csv, NULL '')""",
+         '1,weight,310,1\n'),
+    ]
+    conn.commit.assert_called_once()
+    loader.pool.putconn.assert_called_once_with(conn)
+
+def test_load_table_keeps_key_only_rows(pipeline):
+    loader, conn, cursor = pipeline
+    loader.load_table(pd.DataFrame({'rfid': ['1', '2']}), 'subject', ['rfid'], ['rfid'])
+    assert executed(cursor)[1].endswith('ON CONFLICT ("rfid") DO NOTHING')
+    assert cursor.copied[0][1] == '1\n2\n'
+
+# the exit tab consolidation of the baseline, row by row
+def baseline_exit_tabs(df):
+    out = []
+    for rfid in df['rfid'].unique():
+        if sum(df['rfid'] == rfid) == 1:
+            continue
+        db = df[df['rfid'] == rfid]
+        sampdf = {i: db.iloc[0][i] for i in df.columns}
+        for n in range(1, len(db)):
+            for i in df.columns:
+                if type(sampdf[i]) == str and type(db.iloc[n][i]) == str and sampdf[i] != db.iloc[n][i]:
+                    sampdf[i] = sampdf[i] + ', ' + db.iloc[1][i]
+        out.append(pd.DataFrame(sampdf, index=[db.index[0]]))
+        df = df.drop(db.index)
+    return pd.concat([df] + out) if out else df
+
+def exit_tabs(cohort, df):
+    process = cohort['CohortProcess'].__new__(cohort['CohortProcess'])
+    return process.organize_exit_tabs(df)
+
+def test_organize_exit_tabs_merges_rfids_listed_twice_like_the_baseline(cohort):
+    df = pd.DataFrame({
+        'rfid': ['1', '2', '1', '3', '3', '4', '4'],
+        'exit_code': ['Death', 'Completed', 'Sick', np.nan, 'Sick', 'Death', 'Death'],
+        'exit_notes': ['found', 'ok', np.nan, 'a', 'b', 'x', 'y'],
+        'exit_day': [10, 20, 11, 30, 31, 40, 41],
+    })
+    merged = exit_tabs(cohort, df)
+    pd.testing.assert_frame_equal(merged, baseline_exit_tabs(df))
+    assert list(merged.index) == [1, 0, 3, 5]
+    # the NaN exit code of the first rfid 3 entry takes nothing, the notes missing from the second rfid 1 entry add nothing
+    assert merged['exit_code'].tolist()[:2] == ['Completed', 'Death, Sick'] and pd.isna(merged['exit_code'].iloc[2])
+    assert merged['exit_code'].iloc[3] == 'Death'
+    assert list(merged['exit_notes']) == ['ok', 'found', 'a, b', 'x, y']
+    assert list(merged['exit_day']) == [20, 10, 30, 40]
+
+def test_organize_exit_tabs_joins_the_distinct_strings_of_every_entry(cohort):
+    # the baseline appended the second entry once per differing entry ('a, b, b' for a, b, c and 'a, b, b' for a, b, a)
+    df = pd.DataFrame({'rfid': ['1', '1', '1', '2', '2', '2'], 'exit_notes': ['a', 'b', 'c', 'a', 'b', 'a']})
+    merged = exit_tabs(cohort, df)
+    assert list(merged.index) == [0, 3]
+    assert list(merged['exit_notes']) == ['a, b, c', 'a, b']
+
+def test_organize_exit_tabs_leaves_single_entries_alone(cohort):
+    df = pd.DataFrame({'rfid': ['1', '2'], 'exit_notes': ['a', 'b']})
+    assert exit_tabs(cohort, df) is df